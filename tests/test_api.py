@@ -17,11 +17,14 @@ def test():
     _ = api.Repository.get_artifact_s3path
     _ = api.Repository.put_artifact
     _ = api.Repository.get_artifact_version
+    _ = api.Repository.get_artifact_versions
     _ = api.Repository.list_artifact_versions
+    _ = api.Repository.iter_artifact_versions
     _ = api.Repository.publish_artifact_version
     _ = api.Repository.delete_artifact_version
     _ = api.Repository.put_alias
     _ = api.Repository.get_alias
+    _ = api.Repository.get_alias_with_artifact
     _ = api.Repository.list_aliases
     _ = api.Repository.delete_alias
     _ = api.Repository.purge_artifact
@@ -32,6 +35,7 @@ def test():
     _ = api.Alias.get_version_content
     _ = api.Alias.s3path_secondary_version
     _ = api.Alias.get_secondary_version_content
+    _ = api.Alias.get_both_version_content
     _ = api.s3_and_dynamodb_backend
     _ = api.s3_only_backend
 
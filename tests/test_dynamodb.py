@@ -1,6 +1,24 @@
 # -*- coding: utf-8 -*-
 
-from versioned.dynamodb import encode_version, encode_version_sk
+from datetime import timezone
+
+import pytest
+
+from versioned.dynamodb import (
+    Artifact,
+    Alias,
+    get_utc_now,
+    encode_version,
+    encode_version_sk,
+    decode_version_sk,
+    encode_alias_pk,
+)
+
+
+def test_get_utc_now():
+    now = get_utc_now()
+    assert now.tzinfo is timezone.utc
+    assert get_utc_now() >= now
 
 
 def test_encode_version():
@@ -10,6 +28,9 @@ def test_encode_version():
     assert encode_version(999999) == "999999"
     assert encode_version("1") == "1"
     assert encode_version("000001") == "1"
+    # equal keys of another type don't get the cached result of each other
+    assert encode_version(1.0) == "1.0"
+    assert encode_version(1) == "1"
 
 
 def test_encode_version_sk():
@@ -21,6 +42,74 @@ def test_encode_version_sk():
     assert encode_version_sk(999999) == "999999"
     assert encode_version_sk(2) == "000002"
     assert encode_version_sk(1) == "000001"
+    assert encode_version_sk("000001") == "000001"
+    assert encode_version_sk(1023) == "001023"
+    assert encode_version_sk(1024) == "001024"
+    assert encode_version_sk("1024") == "001024"
+
+
+def test_decode_version_sk():
+    assert decode_version_sk("LATEST") == "LATEST"
+    assert decode_version_sk("000001") == "1"
+    assert decode_version_sk("999999") == "999999"
+
+
+def test_encode_alias_pk():
+    assert encode_alias_pk("app") == "__app-alias"
+    assert encode_alias_pk("my-app") == "__my-app-alias"
+    assert encode_alias_pk("my-app") == encode_alias_pk("my-app")
+    # Alias.name decodes the partition key back, hyphens in the name included
+    for name in ["app", "my-app", "my-alias-app-alias"]:
+        alias = Alias.new(name=name, alias="LIVE")
+        assert alias.pk == encode_alias_pk(name)
+        assert alias.name == name
+
+
+def test_fast_new():
+    artifact = Artifact.new(name="my-app", version=1)
+    assert artifact.attribute_values == Artifact(
+        pk="my-app", sk="000001"
+    ).attribute_values
+    artifact = Artifact.new(name="my-app")
+    assert artifact.sk == "LATEST"
+    assert artifact.is_deleted is False
+
+    alias = Alias.new(name="my-app", alias="dev", version=1)
+    assert alias.attribute_values == Alias(
+        pk=encode_alias_pk("my-app"),
+        sk="dev",
+        update_at=alias.update_at,
+        version="000001",
+    ).attribute_values
+    alias = Alias.new(
+        name="my-app",
+        alias="dev",
+        version=1,
+        secondary_version=2,
+        secondary_version_weight=20,
+    )
+    assert alias.attribute_values == Alias(
+        pk=encode_alias_pk("my-app"),
+        sk="dev",
+        update_at=alias.update_at,
+        version="000001",
+        secondary_version="000002",
+        secondary_version_weight=20,
+    ).attribute_values
+    with pytest.raises(ValueError):
+        Alias._fast_new({"pk": "my-app", "sk": "dev", "typo": 1})
+
+    alias = Alias.new(name="my-app", alias="dev", version=1)
+    assert alias.version == "000001"
+    assert alias.secondary_version is None
+    assert alias.name == "my-app"
+
+    # the derived fields follow a reassigned key
+    assert artifact.version == "LATEST"
+    artifact.sk = encode_version_sk(2)
+    assert artifact.version == "2"
+    alias.pk = encode_alias_pk("other-app")
+    assert alias.name == "other-app"
 
 
 if __name__ == "__main__":
@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import io
+import gc
+import dataclasses
+import hashlib
+from unittest.mock import patch
+
 import moto
 import pytest
+from boto_session_manager import BotoSesManager
 
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 from s3pathlib import S3Path, context
+from pynamodb.exceptions import UpdateError
 
 from versioned import exc
 from versioned import constants
-from versioned.dynamodb import encode_version_sk
+from versioned.dynamodb import encode_version_sk, encode_alias_pk, get_utc_now
+from versioned import bootstrap
 from versioned.tests.mock_aws import BaseMockTest
 from versioned.s3_and_dynamodb_backend import (
     Alias,
     Repository,
+    _batch_delete,
 )
 
 from rich import print as rprint
@@ -34,6 +44,16 @@ class TestAlias:
         for _ in range(10):
             assert ali.random_artifact() in ["s3uri1", "s3uri2"]
 
+        # weight 0 never routes to the secondary version
+        ali = dataclasses.replace(ali, secondary_version_weight=0)
+        for _ in range(10):
+            assert ali.random_artifact() == "s3uri1"
+        # the weight is read at every call, even if changed afterwards
+        ali.secondary_version_weight = 100
+        for _ in range(10):
+            assert ali.random_artifact() == "s3uri2"
+        ali.secondary_version_weight = 0
+
         ali = Alias(
             name="deploy",
             alias="LIVE",
@@ -64,6 +84,8 @@ class Test(BaseMockTest):
 
     @classmethod
     def setup_class_post_hook(cls):
+        # start from an empty bootstrap cache whatever ran before
+        bootstrap.cache_clear()
         context.attach_boto_session(cls.bsm.boto_ses)
         cls.repo = Repository(
             aws_region=cls.bsm.aws_region,
@@ -72,6 +94,76 @@ class Test(BaseMockTest):
         )
         cls.repo.bootstrap(cls.bsm)
 
+    def _test_bootstrap(self):
+        # the second call within the TTL is served from the cache
+        assert len(bootstrap._BOOTSTRAP_CACHE) == 1
+        self.repo.bootstrap(self.bsm)
+        assert len(bootstrap._BOOTSTRAP_CACHE) == 1
+        assert self.repo._artifact_class is self.repo._artifact_class
+        assert self.repo._alias_class is self.repo._alias_class
+        # connecting the boto session already in use does nothing
+        s3_client = context.s3_client
+        assert bootstrap.attach_boto_session(self.bsm) is False
+        self.repo.connect_boto_session(self.bsm)
+        assert context.s3_client is s3_client
+        # only the S3 client we create is tuned, the boto session is left alone,
+        # it also pins the private s3pathlib attribute behind context.s3_client
+        assert s3_client is bootstrap._attached[1]
+        config = s3_client.meta.config
+        assert config.max_pool_connections == constants.MAX_POOL_CONNECTIONS
+        assert self.bsm.boto_ses._session.get_default_client_config() is None
+        # building the cache key sends no STS GetCallerIdentity call
+        with patch.object(
+            type(self.bsm), "_get_caller_identity", side_effect=AssertionError
+        ):
+            self.repo.bootstrap(self.bsm)
+
+        # a new boto session is bootstrapped again, even if it is allocated
+        # where a collected one used to be
+        def new_bsm_bootstrap() -> int:
+            bsm = BotoSesManager(region_name=self.bsm.aws_region)
+            with patch.object(
+                bsm.s3_client, "head_bucket", wraps=bsm.s3_client.head_bucket
+            ) as head_bucket:
+                self.repo.bootstrap(bsm)
+            return head_bucket.call_count
+
+        assert new_bsm_bootstrap() == 1
+        self.repo.connect_boto_session(self.bsm)
+        gc.collect()
+        assert len(bootstrap._BOOTSTRAP_CACHE) == 1
+        assert new_bsm_bootstrap() == 1
+        self.repo.connect_boto_session(self.bsm)
+
+        # the model classes are refreshed when another boto session connects,
+        # even if bootstrap() already attached it to s3pathlib
+        Artifact = self.repo._artifact_class
+        self.repo.connect_boto_session(self.bsm)
+        assert self.repo._artifact_class is Artifact
+        other_bsm = BotoSesManager(region_name=self.bsm.aws_region)
+        self.repo.bootstrap(other_bsm)
+        self.repo.connect_boto_session(other_bsm)
+        assert self.repo._artifact_class is not Artifact
+        self.repo.connect_boto_session(self.bsm)
+        del other_bsm
+
+        # a missing bucket is created, an existing one is left as is
+        bucket = f"{self.repo.s3_bucket}-new"
+        for _ in range(2):
+            bootstrap.bootstrap(
+                bsm=self.bsm,
+                aws_region=self.repo.aws_region,
+                bucket_name=bucket,
+                dynamodb_table_name=self.repo.dynamodb_table_name,
+            )
+            bootstrap.cache_clear()
+            self.bsm.s3_client.head_bucket(Bucket=bucket)
+        for version in [None, 1, "2"]:
+            assert (
+                self.repo._get_artifact_s3uri(name="my-app", version=version)
+                == self.repo.get_artifact_s3path(name="my-app", version=version).uri
+            )
+
     def _test_error(self):
         name = "deploy"
 
@@ -85,6 +177,9 @@ class Test(BaseMockTest):
         with pytest.raises(exc.ArtifactNotFoundError):
             self.repo.get_artifact_version(name=name)
 
+        with pytest.raises(exc.ArtifactNotFoundError):
+            self.repo.get_artifact_versions(name=name, versions=[None, 1])
+
         artifact_list = self.repo.list_artifact_versions(name=name)
         assert len(artifact_list) == 0
 
@@ -112,6 +207,15 @@ class Test(BaseMockTest):
                 secondary_version_weight=0.5,
             )
 
+        # secondary_version_weight type is wrong, bool is not accepted
+        with pytest.raises(TypeError):
+            self.repo.put_alias(
+                name=name,
+                alias=alias,
+                secondary_version=999,
+                secondary_version_weight=True,
+            )
+
         # secondary_version_weight value range is wrong
         with pytest.raises(ValueError):
             self.repo.put_alias(
@@ -188,6 +292,10 @@ class Test(BaseMockTest):
 
         _assert_artifact(artifact)
 
+        # file object content is hashed in chunks, same content, no change
+        artifact = self.repo.put_artifact(name=name, content=io.BytesIO(b"v1"))
+        _assert_artifact(artifact)
+
         artifact = self.repo.get_artifact_version(name=name)
         # rprint(artifact)
         _assert_artifact(artifact)
@@ -206,9 +314,12 @@ class Test(BaseMockTest):
         )
         assert artifact.s3path.metadata["foo"] == "bar"
         assert artifact.get_content(bsm=self.bsm) == b"v1"
+        assert artifact.get_content() == b"v1"
+        # update_at comes from the CopyObject result
+        assert artifact.update_at == artifact.s3path.last_modified_at
 
         # put artifact again
-        artifact = self.repo.put_artifact(name=name, content=b"v2")
+        artifact = self.repo.put_artifact(name=name, content=io.BytesIO(b"v2"))
         # rprint(artifact)
         assert artifact.version == constants.LATEST_VERSION
         assert S3Path(artifact.s3uri).read_text(bsm=self.bsm) == "v2"
@@ -226,6 +337,65 @@ class Test(BaseMockTest):
         artifact_list = self.repo.list_artifact_versions(name=name)
         assert len(artifact_list) == 3
 
+        artifact_list = self.repo.list_artifact_versions(name=name, limit=2)
+        assert [artifact.version for artifact in artifact_list] == [
+            constants.LATEST_VERSION,
+            "2",
+        ]
+
+        artifact_list = self.repo.get_artifact_versions(
+            name=name, versions=[2, None, 1]
+        )
+        assert [artifact.version for artifact in artifact_list] == [
+            "2",
+            constants.LATEST_VERSION,
+            "1",
+        ]
+        assert artifact_list[0].get_content(bsm=self.bsm) == b"v2"
+
+        # equivalent versions are sent as one key, BatchGetItem rejects duplicates
+        Artifact = self.repo._artifact_class
+        with patch.object(
+            Artifact, "batch_get", wraps=Artifact.batch_get
+        ) as batch_get:
+            artifact_list = self.repo.get_artifact_versions(
+                name=name, versions=[1, "1", "000001", None, "LATEST"]
+            )
+        assert [artifact.version for artifact in artifact_list] == [
+            "1",
+            "1",
+            "1",
+            constants.LATEST_VERSION,
+            constants.LATEST_VERSION,
+        ]
+        assert list(batch_get.call_args[0][0]) == [
+            (name, encode_version_sk(1)),
+            (name, constants.LATEST_VERSION),
+        ]
+
+        # strongly consistent reads, with repeated and equivalent versions
+        with patch.object(
+            Artifact, "batch_get", wraps=Artifact.batch_get
+        ) as batch_get:
+            artifact_list = self.repo.get_artifact_versions(
+                name=name,
+                versions=[2, "2", "000002", None, constants.LATEST_VERSION, 2],
+                consistent_read=True,
+            )
+        assert [artifact.version for artifact in artifact_list] == [
+            "2",
+            "2",
+            "2",
+            constants.LATEST_VERSION,
+            constants.LATEST_VERSION,
+            "2",
+        ]
+        assert list(batch_get.call_args[0][0]) == [
+            (name, encode_version_sk(2)),
+            (name, constants.LATEST_VERSION),
+        ]
+        assert batch_get.call_args[1]["consistent_read"] is True
+
         # ======================================================================
         # Alias
         # ======================================================================
@@ -244,6 +414,7 @@ class Test(BaseMockTest):
             assert ali.version_s3uri.endswith(constants.LATEST_VERSION + ".txt")
             assert ali.secondary_version_s3uri is None
             assert ali.get_version_content(bsm=self.bsm) == b"v2"
+            assert ali.get_both_version_content(bsm=self.bsm) == (b"v2", None)
 
         _assert_alias(ali)
 
@@ -255,6 +426,12 @@ class Test(BaseMockTest):
         assert len(ali_list) == 1
         _assert_alias(ali_list[0])
 
+        _, artifact, secondary_artifact = self.repo.get_alias_with_artifact(
+            name=name, alias=alias
+        )
+        assert artifact.version == constants.LATEST_VERSION
+        assert secondary_artifact is None
+
         # put alias again
         ali = self.repo.put_alias(
             name=name,
@@ -276,6 +453,9 @@ class Test(BaseMockTest):
             assert ali.secondary_version_s3uri.endswith(encode_version_sk(2) + ".txt")
             assert ali.get_version_content(bsm=self.bsm) == b"v1"
             assert ali.get_secondary_version_content(bsm=self.bsm) == b"v2"
+            assert ali.get_both_version_content(bsm=self.bsm) == (b"v1", b"v2")
+            # use the boto session attached by bootstrap
+            assert ali.get_both_version_content() == (b"v1", b"v2")
 
         _assert_alias(ali)
 
@@ -287,6 +467,19 @@ class Test(BaseMockTest):
         assert len(ali_list) == 1
         _assert_alias(ali_list[0])
 
+        ali, artifact, secondary_artifact = self.repo.get_alias_with_artifact(
+            name=name, alias=alias
+        )
+        _assert_alias(ali)
+        assert artifact.version == "1"
+        assert secondary_artifact.version == "2"
+        assert secondary_artifact.s3uri == ali.secondary_version_s3uri
+        ali, artifact, secondary_artifact = self.repo.get_alias_with_artifact(
+            name=name, alias=alias, consistent_read=True
+        )
+        _assert_alias(ali)
+        assert (artifact.version, secondary_artifact.version) == ("1", "2")
+
         # --- test delete methods
         self.repo.delete_alias(name=name, alias=alias)
         with pytest.raises(exc.AliasNotFoundError):
@@ -306,6 +499,22 @@ class Test(BaseMockTest):
         artifact_list = self.repo.list_artifact_versions(name=name)
         assert len(artifact_list) == 1
 
+        # can't put alias on a soft deleted version
+        with pytest.raises(exc.ArtifactNotFoundError):
+            self.repo.put_alias(name=name, alias="DELETED", version=1)
+        with pytest.raises(exc.ArtifactNotFoundError) as e:
+            self.repo.put_alias(
+                name=name,
+                alias="DELETED",
+                version=2,
+                secondary_version=1,
+                secondary_version_weight=20,
+            )
+        assert "version = '1'" in str(e.value)
+        # the alias is not saved if any version check fails
+        with pytest.raises(exc.AliasNotFoundError):
+            self.repo.get_alias(name=name, alias="DELETED")
+
         # it is a soft delete, so S3 artifact is not deleted
         assert s3path.parent.count_objects(bsm=self.bsm) == 3
 
@@ -324,6 +533,157 @@ class Test(BaseMockTest):
         ali_list = self.repo.list_aliases(name=name)
         assert len(ali_list) == 0
 
+    def _test_publish_artifact_version_idempotency(self):
+        name = "idempotency"
+        self.repo.purge_artifact(name=name)
+        self.repo.put_artifact(name=name, content=b"v1")
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="a")
+        assert artifact.version == "1"
+
+        # a retry returns the last published version
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="a")
+        assert artifact.version == "1"
+        assert len(self.repo.list_artifact_versions(name=name)) == 2
+
+        # a new key or no key publishes a new version
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="b")
+        assert artifact.version == "2"
+        assert self.repo.publish_artifact_version(name=name).version == "3"
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="b")
+        assert artifact.version == "4"
+
+        # the last publish failed after it got the version number
+        latest, is_retry = self.repo._allocate_version_number(
+            name=name,
+            idempotency_key="c",
+        )
+        assert (latest.latest_version_number, is_retry) == (5, False)
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="c")
+        assert artifact.version == "5"
+        assert artifact.get_content(bsm=self.bsm) == b"v1"
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="c")
+        assert artifact.version == "5"
+
+        # the counter is seeded alongside the key
+        Artifact = self.repo._artifact_class
+        Artifact.new(name=name).update(
+            actions=[Artifact.latest_version_number.remove()],
+        )
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="d")
+        assert artifact.version == "6"
+        artifact = self.repo.publish_artifact_version(name=name, idempotency_key="d")
+        assert artifact.version == "6"
+
+        with pytest.raises(exc.ArtifactNotFoundError):
+            self.repo.publish_artifact_version(name="not-exists", idempotency_key="a")
+
+    def _test_publish_artifact_version_counter(self):
+        name = "counter"
+        self.repo.purge_artifact(name=name)
+        self.repo.put_artifact(name=name, content=b"v1")
+        assert self.repo.publish_artifact_version(name=name).version == "1"
+        assert self.repo.publish_artifact_version(name=name).version == "2"
+
+        # artifacts published before the version counter existed don't have it
+        Artifact = self.repo._artifact_class
+        Artifact.new(name=name).update(
+            actions=[Artifact.latest_version_number.remove()],
+        )
+        assert self.repo.publish_artifact_version(name=name).version == "3"
+
+        # put artifact keeps the counter
+        self.repo.put_artifact(name=name, content=b"v2")
+        artifact = self.repo.publish_artifact_version(name=name)
+        assert artifact.version == "4"
+        assert artifact.get_content(bsm=self.bsm) == b"v2"
+
+        # DynamoDB already has the content, a concurrent put_artifact with the
+        # same content wrote it, the S3 object is gone to skip the S3 check
+        self.repo.get_artifact_s3path(name=name, version=None).delete()
+        artifact = self.repo.put_artifact(name=name, content=b"v2")
+        assert artifact.sha256 == hashlib.sha256(b"v2").hexdigest()
+        assert artifact.get_content(bsm=self.bsm) == b"v2"
+
+        # a concurrent publish seeds the counter while this one is reading the
+        # last version, the seed fails and the allocation starts over
+        query = Artifact.query
+
+        def concurrent_seed_query(*args, **kwargs):
+            Artifact.new(name=name).update(
+                actions=[Artifact.latest_version_number.set(10)],
+            )
+            return query(*args, **kwargs)
+
+        def remove_counter():
+            Artifact.new(name=name).update(
+                actions=[Artifact.latest_version_number.remove()],
+            )
+
+        remove_counter()
+        with patch.object(Artifact, "query", side_effect=concurrent_seed_query):
+            assert self.repo.publish_artifact_version(name=name).version == "11"
+
+        # the retries are bounded
+        remove_counter()
+        with patch.object(Artifact, "query", side_effect=concurrent_seed_query):
+            with patch(
+                "versioned.s3_and_dynamodb_backend._ALLOCATE_VERSION_NUMBER_ATTEMPTS",
+                1,
+            ):
+                with pytest.raises(UpdateError):
+                    self.repo.publish_artifact_version(name=name)
+
+    def _test_cache(self):
+        name = "cached"
+        repo = Repository(
+            aws_region=self.repo.aws_region,
+            s3_bucket=self.repo.s3_bucket,
+            suffix=".txt",
+            cache_ttl=60,
+        )
+        repo.purge_artifact(name=name)
+        repo.put_artifact(name=name, content=b"v1")
+        artifact = repo.get_artifact_version(name=name)
+        assert repo.get_artifact_version(name=name) == artifact
+        # every caller gets its own copy
+        artifact.sha256 = "changed"
+        assert repo.get_artifact_version(name=name).sha256 != "changed"
+        artifact = repo.get_artifact_version(name=name)
+
+        # changes made by others are not seen until the cache expires
+        self.repo.delete_artifact_version(name=name)
+        assert repo.get_artifact_version(name=name) == artifact
+
+        # changes made by the same repository object invalidate the cache
+        repo.put_artifact(name=name, content=b"v2")
+        assert repo.get_artifact_version(name=name).sha256 != artifact.sha256
+
+        repo.put_alias(name=name, alias="LIVE")
+        ali = repo.get_alias(name=name, alias="LIVE")
+        assert repo.get_alias(name=name, alias="LIVE") == ali
+        # consistent read bypasses the cache
+        ali1, _, _ = repo.get_alias_with_artifact(
+            name=name, alias="LIVE", consistent_read=True
+        )
+        assert ali1 is not ali and ali1 == ali
+        repo.delete_alias(name=name, alias="LIVE")
+        with pytest.raises(exc.AliasNotFoundError):
+            repo.get_alias(name=name, alias="LIVE")
+
+        repo.purge_artifact(name=name)
+        assert len(repo._cache) == 0
+        # cache is disabled by default
+        assert len(self.repo._cache) == 0
+
+        # the least recently used entry is evicted
+        with patch("versioned.s3_and_dynamodb_backend._CACHE_MAXSIZE", 2):
+            repo._cache_set(("a",), artifact)
+            repo._cache_set(("b",), artifact)
+            assert repo._cache_get(("a",)) == artifact
+            repo._cache_set(("c",), artifact)
+            assert list(repo._cache) == [("a",), ("c",)]
+        repo._cache.clear()
+
     def _test_purge_artifact_versions(self):
         name = "life_cycle"
 
@@ -377,11 +737,79 @@ class Test(BaseMockTest):
         names = self.repo.list_artifact_names()
         assert names == ["a", "b"]
 
+    def _test_put_artifact_same_content(self):
+        name = "same_content"
+        Artifact = self.repo._artifact_class
+        self.repo.purge_artifact(name=name)
+        self.repo.put_artifact(name=name, content=b"v1")
+        s3path = self.repo.get_artifact_s3path(name=name, version=None)
+
+        # the same content rewritten later moves the stored update_at forward
+        time.sleep(1)
+        s3path.delete()
+        artifact = self.repo.put_artifact(name=name, content=b"v1")
+        assert artifact.update_at == s3path.head_object()["LastModified"]
+        assert self.repo.get_artifact_version(name=name) == artifact
+
+        # a concurrent writer already stored the same content at a later time,
+        # what is stored is returned
+        later = datetime(2099, 1, 1, tzinfo=timezone.utc)
+        Artifact.new(name=name).update(actions=[Artifact.update_at.set(later)])
+        s3path.delete()
+        artifact = self.repo.put_artifact(name=name, content=b"v1")
+        assert artifact.update_at == later
+        assert self.repo.get_artifact_version(name=name) == artifact
+        self.repo.purge_artifact(name=name)
+
+    def _test_legacy_item(self):
+        # an item written before the sha256 attribute existed
+        name = "legacy"
+        Artifact = self.repo._artifact_class
+        self.bsm.dynamodb_client.put_item(
+            TableName=self.repo.dynamodb_table_name,
+            Item={
+                "pk": {"S": name},
+                "sk": {"S": encode_version_sk(1)},
+                "update_at": {"S": Artifact.update_at.serialize(get_utc_now())},
+                "is_deleted": {"BOOL": False},
+            },
+        )
+        artifact_list = self.repo.list_artifact_versions(name=name)
+        assert [artifact.version for artifact in artifact_list] == ["1"]
+        assert artifact_list[0].sha256 is None
+
+    def _test_batch_delete(self):
+        name = "batch_delete"
+        Alias = self.repo._alias_class
+        # more than one BatchWriteItem request worth of items
+        with Alias.batch_write() as batch:
+            for i in range(30):
+                batch.save(Alias.new(name=name, alias=f"ALIAS{i}"))
+        assert len(self.repo.list_aliases(name=name)) == 30
+        _batch_delete(Alias, Alias.query(hash_key=encode_alias_pk(name)))
+        assert len(self.repo.list_aliases(name=name)) == 0
+
+        # purge_all deletes everything with a parallel scan
+        self.repo.put_artifact(name=name, content=b"v1")
+        with Alias.batch_write() as batch:
+            for i in range(30):
+                batch.save(Alias.new(name=name, alias=f"ALIAS{i}"))
+        self.repo.purge_all()
+        assert self.repo._artifact_class.count() == 0
+        assert self.repo.list_artifact_names() == []
+
     def test(self):
         self.repo.connect_boto_session(self.bsm)
+        self._test_bootstrap()
         self._test_error()
         self._test_artifact_and_alias()
+        self._test_publish_artifact_version_counter()
+        self._test_publish_artifact_version_idempotency()
+        self._test_cache()
         self._test_purge_artifact_versions()
+        self._test_put_artifact_same_content()
+        self._test_legacy_item()
+        self._test_batch_delete()
         self._test_list_artifact_names()
 
 
@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import io
+import dataclasses
+import hashlib
+
 import moto
 import pytest
 import time
@@ -10,7 +14,6 @@ from versioned import exc
 from versioned import constants
 from versioned.tests.mock_aws import BaseMockTest
 from versioned.s3_only_backend import (
-    hashes,
     encode_version,
     encode_filename,
     decode_filename,
@@ -55,6 +58,7 @@ def test_validate_alias_name():
         "LATEST",
         "hello-world",
         "123abc",
+        "",
     ]:
         with pytest.raises(ValueError):
             validate_alias_name(alias)
@@ -75,6 +79,16 @@ class TestAlias:
         for _ in range(10):
             assert ali.random_artifact() in ["s3uri1", "s3uri2"]
 
+        # weight 0 never routes to the secondary version
+        ali = dataclasses.replace(ali, secondary_version_weight=0)
+        for _ in range(10):
+            assert ali.random_artifact() == "s3uri1"
+        # the weight is read at every call, even if changed afterwards
+        ali.secondary_version_weight = 100
+        for _ in range(10):
+            assert ali.random_artifact() == "s3uri2"
+        ali.secondary_version_weight = 0
+
         ali = Alias(
             name="deploy",
             alias="LIVE",
@@ -167,6 +181,16 @@ class Test(BaseMockTest):
                 secondary_version_weight=0.5,
             )
 
+        # secondary_version_weight type is wrong, bool is not accepted
+        with pytest.raises(TypeError):
+            self.repo.put_alias(
+                bsm=self.bsm,
+                name=name,
+                alias=alias,
+                secondary_version=999,
+                secondary_version_weight=True,
+            )
+
         # secondary_version_weight value range is wrong
         with pytest.raises(ValueError):
             self.repo.put_alias(
@@ -251,10 +275,15 @@ class Test(BaseMockTest):
             assert artifact.update_at == expected_update_at
             _ = artifact.update_datetime
             assert artifact.s3uri.endswith(constants.LATEST_VERSION + ".txt")
-            assert artifact.sha256 == hashes.of_bytes(b"v1")
+            assert artifact.sha256 == hashlib.sha256(b"v1").hexdigest()
             assert artifact.get_content(bsm=self.bsm) == b"v1"
 
         _assert_artifact(artifact)
+        # update_datetime follows a reassigned update_at
+        changed = dataclasses.replace(artifact)
+        assert changed.update_datetime.year != 2000
+        changed.update_at = "2000-01-01T00:00:00+00:00"
+        assert changed.update_datetime.year == 2000
 
         assert (
             self.repo.get_latest_published_artifact_version_number(
@@ -268,6 +297,10 @@ class Test(BaseMockTest):
         artifact = self.repo.put_artifact(bsm=self.bsm, name=name, content=b"v1")
         # rprint(artifact)
         _assert_artifact(artifact)
+        artifact = self.repo.put_artifact(
+            bsm=self.bsm, name=name, content=io.BytesIO(b"v1")
+        )
+        _assert_artifact(artifact)
 
         # get artifact by name and version
         artifact = self.repo.get_artifact_version(bsm=self.bsm, name=name)
@@ -289,7 +322,7 @@ class Test(BaseMockTest):
             assert artifact.version == "1"
             _ = artifact.update_datetime
             assert artifact.s3uri.endswith("1.txt")
-            assert artifact.sha256 == hashes.of_bytes(b"v1")
+            assert artifact.sha256 == hashlib.sha256(b"v1").hexdigest()
             assert artifact.get_content(bsm=self.bsm) == b"v1"
             artifact.s3path.head_object(bsm=self.bsm)
             assert artifact.s3path.metadata["foo"] == "bar"
@@ -309,7 +342,9 @@ class Test(BaseMockTest):
         _assert_artifact(artifact)
 
         # put artifact again
-        artifact = self.repo.put_artifact(bsm=self.bsm, name=name, content=b"v2")
+        artifact = self.repo.put_artifact(
+            bsm=self.bsm, name=name, content=io.BytesIO(b"v2")
+        )
         # rprint(artifact)
         assert artifact.version == constants.LATEST_VERSION
         assert S3Path(artifact.s3uri).read_text(bsm=self.bsm) == "v2"
@@ -328,6 +363,23 @@ class Test(BaseMockTest):
         assert artifact_list[0].version == constants.LATEST_VERSION
         assert artifact_list[1].version == "2"
         assert artifact_list[2].version == "1"
+        assert [artifact.sha256 for artifact in artifact_list] == [
+            hashlib.sha256(b"v2").hexdigest(),
+            hashlib.sha256(b"v2").hexdigest(),
+            hashlib.sha256(b"v1").hexdigest(),
+        ]
+
+        # skip the HeadObject calls if the sha256 is not needed
+        artifact_list_no_sha256 = self.repo.list_artifact_versions(
+            bsm=self.bsm,
+            name=name,
+            with_sha256=False,
+        )
+        assert [
+            dataclasses.replace(artifact, sha256=None) for artifact in artifact_list
+        ] == artifact_list_no_sha256
+        for artifact in artifact_list:
+            assert artifact.to_dict() == dataclasses.asdict(artifact)
 
         # ======================================================================
         # Alias
@@ -336,6 +388,7 @@ class Test(BaseMockTest):
         ali = self.repo.put_alias(bsm=self.bsm, name=name, alias=alias)
         # rprint(ali)
         expected_update_at = ali.update_at
+        assert ali.to_dict() == dataclasses.asdict(ali)
 
         def _assert_alias(ali):
             assert ali.name == name
@@ -348,6 +401,7 @@ class Test(BaseMockTest):
             assert ali.version_s3uri.endswith(constants.LATEST_VERSION + ".txt")
             assert ali.secondary_version_s3uri is None
             assert ali.get_version_content(bsm=self.bsm) == b"v2"
+            assert ali.get_both_version_content(bsm=self.bsm) == (b"v2", None)
 
         _assert_alias(ali)
 
@@ -382,6 +436,7 @@ class Test(BaseMockTest):
             assert ali.secondary_version_s3uri.endswith(encode_filename("2") + ".txt")
             assert ali.get_version_content(bsm=self.bsm) == b"v1"
             assert ali.get_secondary_version_content(bsm=self.bsm) == b"v2"
+            assert ali.get_both_version_content(bsm=self.bsm) == (b"v1", b"v2")
 
         _assert_alias(ali)
 
@@ -395,7 +450,7 @@ class Test(BaseMockTest):
         _assert_alias(ali_list[0])
 
         # the second version doesn't exists, should raise error
-        with pytest.raises(exc.ArtifactNotFoundError):
+        with pytest.raises(exc.ArtifactNotFoundError) as e:
             self.repo.put_alias(
                 bsm=self.bsm,
                 name=name,
@@ -403,6 +458,7 @@ class Test(BaseMockTest):
                 secondary_version=999,
                 secondary_version_weight=50,
             )
+        assert "version = 999" in str(e.value)
 
     def _test_delete_and_purge(self):
         name = "deploy"
@@ -431,6 +487,9 @@ class Test(BaseMockTest):
 
         ali_list = self.repo.list_aliases(bsm=self.bsm, name=name)
         assert len(ali_list) == 2
+        # in the S3 listing order
+        assert [ali.alias for ali in ali_list] == [DEV, LIVE]
+        assert ali_list[1].secondary_version == "3"
 
         # delete alias then get it back, should raise error
         self.repo.delete_alias(bsm=self.bsm, name=name, alias=DEV)
@@ -486,6 +545,10 @@ class Test(BaseMockTest):
             "3",
         ]
         assert [artifact.version for artifact in deleted_artifact_list] == ["2", "1"]
+        assert [artifact.sha256 for artifact in deleted_artifact_list] == [
+            hashlib.sha256(b"v2").hexdigest(),
+            hashlib.sha256(b"v1").hexdigest(),
+        ]
 
         reset()
         purge_time, deleted_artifact_list = self.repo.purge_artifact_versions(
@@ -511,7 +574,12 @@ class Test(BaseMockTest):
         names = self.repo.list_artifact_names(bsm=self.bsm)
         assert names == ["a", "b"]
 
+    def _test_bootstrap(self):
+        # the caller's boto session is left as it is
+        assert self.bsm.boto_ses._session.get_default_client_config() is None
+
     def test(self):
+        self._test_bootstrap()
         self._test_error()
         self._test_artifact_and_alias()
         self._test_delete_and_purge()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+import pytest
+import moto
+from botocore.exceptions import ClientError
+from s3pathlib import S3Path
+
+from versioned import utils
+from versioned.utils import read_content, list_dir_names, copy_content
+from versioned.tests.mock_aws import BaseMockTest
+
+
+class Test(BaseMockTest):
+    use_mock = True
+
+    mock_list = [
+        moto.mock_s3,
+    ]
+
+    _mock_list = []
+
+    bucket = "versioned-utils-test"
+
+    @classmethod
+    def setup_class_post_hook(cls):
+        cls.bsm.s3_client.create_bucket(Bucket=cls.bucket)
+
+    def _test_read_content(self):
+        for content in [b"", b"abc", b"abcd", b"0123456789"]:
+            s3path = S3Path(self.bucket, f"read_content/{len(content)}.txt")
+            s3path.write_bytes(content, bsm=self.bsm)
+            # small chunk size to go through the concurrent ranged GETs
+            assert read_content(s3path, bsm=self.bsm, chunk_size=4) == content
+            assert read_content(s3path, bsm=self.bsm) == content
+
+        s3_client = self.bsm.s3_client
+        get_object = s3_client.get_object
+
+        # an empty content takes a single request
+        s3path = S3Path(self.bucket, "read_content/0.txt")
+        with patch.object(s3_client, "get_object", wraps=get_object) as mock:
+            assert read_content(s3path, bsm=self.bsm) == b""
+        assert mock.call_count == 1
+
+        # the content changes on every read, give up after a few attempts
+        s3path = S3Path(self.bucket, "read_content/10.txt")
+        error = ClientError(
+            {"Error": {"Code": "PreconditionFailed", "Message": ""}},
+            "GetObject",
+        )
+        first_reads = list()
+
+        def overwritten(**kwargs):
+            if "IfMatch" in kwargs:
+                raise error
+            first_reads.append(kwargs)
+            return get_object(**kwargs)
+
+        with patch.object(s3_client, "get_object", side_effect=overwritten):
+            with pytest.raises(ClientError):
+                read_content(s3path, bsm=self.bsm, chunk_size=4)
+        assert len(first_reads) == utils.READ_CONTENT_ATTEMPTS
+
+    def _test_list_dir_names(self):
+        s3dir = S3Path(self.bucket, "list_dir_names/").to_dir()
+        for key in ["a/1.txt", "a/2.txt", "b/c/1.txt", "1.txt"]:
+            s3dir.joinpath(key).write_bytes(b"", bsm=self.bsm)
+        assert list_dir_names(s3dir, bsm=self.bsm) == ["a", "b"]
+        assert list_dir_names(s3dir.joinpath("b/").to_dir(), bsm=self.bsm) == ["c"]
+        assert list_dir_names(s3dir.joinpath("a/").to_dir(), bsm=self.bsm) == []
+
+    def _test_copy_content(self):
+        s3_client = self.bsm.s3_client
+        s3path_src = S3Path(self.bucket, "copy_content/src.txt")
+        s3path_dst = S3Path(self.bucket, "copy_content/dst.txt")
+        s3path_src.write_bytes(
+            b"abc",
+            metadata={"k": "v"},
+            content_type="text/plain",
+            tags={"tag": "value"},
+            bsm=self.bsm,
+        )
+        error = ClientError(
+            {"Error": {"Code": "InvalidRequest", "Message": "too large"}},
+            "CopyObject",
+        )
+        copy_object = s3_client.copy_object
+        calls = list()
+
+        def reject_first_copy(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise error
+            return copy_object(**kwargs)
+
+        # a small source doesn't hide the error behind the managed copy
+        with patch.object(s3_client, "copy_object", side_effect=reject_first_copy):
+            with pytest.raises(ClientError):
+                copy_content(s3path_src, s3path_dst, bsm=self.bsm)
+        assert s3path_dst.exists(bsm=self.bsm) is False
+
+        # a large source falls back to the managed copy, tags included
+        calls.clear()
+        with patch.object(s3_client, "copy_object", side_effect=reject_first_copy):
+            with patch.object(utils, "COPY_OBJECT_MAX_SIZE", 1):
+                update_at = copy_content(s3path_src, s3path_dst, bsm=self.bsm)
+        assert len(calls) == 2
+        res = s3_client.head_object(Bucket=self.bucket, Key=s3path_dst.key)
+        assert update_at == res["LastModified"]
+        assert res["Metadata"] == {"k": "v"}
+        assert res["ContentType"] == "text/plain"
+        assert s3_client.get_object_tagging(
+            Bucket=self.bucket, Key=s3path_dst.key
+        )["TagSet"] == [{"Key": "tag", "Value": "value"}]
+        assert s3path_dst.read_bytes(bsm=self.bsm) == b"abc"
+
+    def test(self):
+        self._test_read_content()
+        self._test_list_dir_names()
+        self._test_copy_content()
+
+
+if __name__ == "__main__":
+    from versioned.tests import run_cov_test
+
+    run_cov_test(__file__, "versioned.utils", preview=False)
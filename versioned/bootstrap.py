@@ -5,12 +5,108 @@ Todo: docstring
 """
 
 import typing as T
+import time
+import functools
+import threading
+import weakref
+
+from botocore.exceptions import ClientError
 from boto_session_manager import BotoSesManager
 from s3pathlib import context
 
 from pynamodb.models import PAY_PER_REQUEST_BILLING_MODE
 from pynamodb.connection import Connection
+from pynamodb.constants import TABLE_STATUS, ACTIVE
+from pynamodb.exceptions import TableDoesNotExist
 from . import dynamodb
+from .constants import MAX_POOL_CONNECTIONS
+from .utils import BOTO_CLIENT_CONFIG
+
+# boto session -> {(aws_region, bucket_name, dynamodb_table_name): bootstrap time}
+# weakly keyed on the session itself, the id() of a collected session can be
+# reused by a new one with another credential
+_BOOTSTRAP_CACHE: "weakref.WeakKeyDictionary[T.Any, T.Dict[tuple, float]]" = (
+    weakref.WeakKeyDictionary()
+)
+_BOOTSTRAP_CACHE_LOCK = threading.Lock()
+_TTL = 300
+
+
+# (boto session, S3 client) given to s3pathlib by the last attach_boto_session()
+_attached: T.Tuple[T.Any, T.Any] = (None, None)
+_ATTACH_LOCK = threading.Lock()
+
+
+def attach_boto_session(bsm: BotoSesManager) -> bool:
+    """
+    Let ``s3pathlib`` use the boto session of the given boto session manager,
+    with an S3 client using :data:`~versioned.utils.BOTO_CLIENT_CONFIG`.
+
+    :return: False if ``s3pathlib`` is already using this boto session and
+        nothing is done, True otherwise.
+    """
+    global _attached
+    with _ATTACH_LOCK:
+        boto_ses, s3_client = _attached
+        if (
+            context.boto_ses is bsm.boto_ses
+            and context.boto_ses is boto_ses
+            and context._s3_client is s3_client
+        ):
+            return False
+        context.attach_boto_session(bsm.boto_ses)
+        # s3pathlib lazily creates the client with the default config and has
+        # no public way to give it one, set the attribute its property reads,
+        # fail loudly rather than being ignored if s3pathlib renames it
+        if not hasattr(context, "_s3_client"):  # pragma: no cover
+            raise RuntimeError(
+                "s3pathlib context has no '_s3_client' attribute anymore, "
+                "this s3pathlib version is not supported"
+            )
+        s3_client = bsm.boto_ses.client("s3", config=BOTO_CLIENT_CONFIG)
+        context._s3_client = s3_client
+        _attached = (bsm.boto_ses, s3_client)
+        return True
+
+
+def cache_clear():
+    """
+    Forget all the previous :func:`bootstrap` calls, the next call will
+    check the S3 bucket and DynamoDB table again.
+    """
+    with _BOOTSTRAP_CACHE_LOCK:
+        _BOOTSTRAP_CACHE.clear()
+
+
+@functools.lru_cache(maxsize=32, typed=True)
+def _get_base_class(
+    table_name: str,
+    region: str,
+    write_capacity_units: T.Optional[int] = None,
+    read_capacity_units: T.Optional[int] = None,
+) -> T.Type[dynamodb.Base]:
+    """
+    Get the pynamodb model class bound to the given table. The class is
+    cached, pynamodb's metaclass does quite some work for every new class.
+    """
+    if write_capacity_units is None and read_capacity_units is None:
+        meta = dict(billing_mode=PAY_PER_REQUEST_BILLING_MODE)
+    else:  # pragma: no cover
+        meta = dict(
+            write_capacity_units=write_capacity_units,
+            read_capacity_units=read_capacity_units,
+        )
+    Meta = type(
+        "Meta",
+        (),
+        dict(
+            table_name=table_name,
+            region=region,
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            **meta,
+        ),
+    )
+    return type("Base", (dynamodb.Base,), {"Meta": Meta})
 
 
 def bootstrap(
@@ -24,49 +120,55 @@ def bootstrap(
     """
     Bootstrap the associated AWS account and region in the boto session manager.
     Create the S3 bucket and DynamoDB table if not exist.
+
+    The result is cached for ``_TTL`` seconds per boto session, region, bucket
+    and table, calling it again within that period does nothing. Use
+    :func:`cache_clear` to reset the cache.
     """
     # validate input arguments
-    if sum(
-        [
-            dynamodb_write_capacity_units is None,
-            dynamodb_read_capacity_units is None,
-        ]
-    ) not in [
-        0,
-        2,
-    ]:  # pragma: no cover
-        raise ValueError
+    if (dynamodb_write_capacity_units is None) ^ (
+        dynamodb_read_capacity_units is None
+    ):  # pragma: no cover
+        raise ValueError(
+            "dynamodb_write_capacity_units and dynamodb_read_capacity_units "
+            "must be both provided or both omitted"
+        )
+
+    attach_boto_session(bsm)
+
+    # the boto session identity is local, bsm.aws_account_id would call STS
+    cache_key = (aws_region, bucket_name, dynamodb_table_name)
+    with _BOOTSTRAP_CACHE_LOCK:
+        bootstrap_at = _BOOTSTRAP_CACHE.get(bsm.boto_ses, {}).get(cache_key)
+    if bootstrap_at is not None and (time.monotonic() - bootstrap_at) < _TTL:
+        return
 
     # create s3 bucket
     try:
         bsm.s3_client.head_bucket(Bucket=bucket_name)
-    except Exception as e: # pragma: no cover
-        if "Not Found" in str(e):
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchBucket"):
             bsm.s3_client.create_bucket(Bucket=bucket_name)
-        else:
-            raise e
+        else:  # pragma: no cover
+            raise
 
     # create dynamodb table
-    if (
-        dynamodb_write_capacity_units is None
-        and dynamodb_read_capacity_units is None
-    ):
-        class Base(dynamodb.Base):
-            class Meta:
-                table_name = dynamodb_table_name
-                region = aws_region
-                billing_mode = PAY_PER_REQUEST_BILLING_MODE
-
-    else:  # pragma: no cover
-
-        class Base(dynamodb.Base):
-            class Meta:
-                table_name = dynamodb_table_name
-                region = aws_region
-                write_capacity_units = dynamodb_write_capacity_units
-                read_capacity_units = dynamodb_read_capacity_units
-
-    context.attach_boto_session(bsm.boto_ses)
+    Base = _get_base_class(
+        table_name=dynamodb_table_name,
+        region=aws_region,
+        write_capacity_units=dynamodb_write_capacity_units,
+        read_capacity_units=dynamodb_read_capacity_units,
+    )
     with bsm.awscli():
         Connection()
-        Base.create_table(wait=True)
+        # create_table(wait=True) describes the table twice even if it exists,
+        # a single describe call is enough in the common case
+        try:
+            table_status = Base.describe_table()[TABLE_STATUS]
+        except TableDoesNotExist:
+            table_status = None
+        if table_status != ACTIVE:
+            Base.create_table(wait=True)
+
+    with _BOOTSTRAP_CACHE_LOCK:
+        _BOOTSTRAP_CACHE.setdefault(bsm.boto_ses, {})[cache_key] = time.monotonic()
@@ -16,3 +16,17 @@ if sys.version_info.minor < 8:
     from cached_property import cached_property
 else:
     from functools import cached_property
+
+# orjson is an optional speedup for the alias json files of the s3_only_backend
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps_bytes = orjson.dumps
+except ImportError:  # pragma: no cover
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps_bytes(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
@@ -9,3 +9,5 @@ S3_PREFIX = "versioned-artifacts"
 LATEST_VERSION = "LATEST"
 VERSION_ZFILL = 6
 METADATA_KEY_ARTIFACT_SHA256 = "artifact_sha256"
+# HTTP connection pool size of the boto clients, botocore defaults to 10
+MAX_POOL_CONNECTIONS = 32
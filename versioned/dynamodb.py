@@ -5,6 +5,7 @@ Tje dynamodb backend to store metadata of artifacts, versions and aliases.
 """
 
 import typing as T
+import functools
 from datetime import datetime, timezone
 
 from pynamodb.models import Model
@@ -20,9 +21,11 @@ from .constants import (
 
 
 def get_utc_now() -> datetime:
-    return datetime.utcnow().replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc)
 
 
+# typed, so 1 and 1.0 don't share an entry, they encode differently
+@functools.lru_cache(maxsize=4096, typed=True)
 def encode_version(version: T.Optional[T.Union[int, str]]) -> str:
     """
     Encode human readable "version" into the data class field "version".
@@ -34,12 +37,18 @@ def encode_version(version: T.Optional[T.Union[int, str]]) -> str:
         1       -> 1
         000001  -> 1
     """
-    if version is None:
+    if version is None or version == LATEST_VERSION:
         return LATEST_VERSION
+    elif type(version) is int:
+        return str(version)
     else:
         return str(version).lstrip("0")
 
 
+# pre-encoded sort key for the most common small version numbers
+_VERSION_SK_LUT = tuple(str(i).zfill(VERSION_ZFILL) for i in range(1024))
+
+
 def encode_version_sk(version: T.Optional[T.Union[int, str]]) -> str:
     """
     Get the Dynamodb sort key of a version.
@@ -53,16 +62,46 @@ def encode_version_sk(version: T.Optional[T.Union[int, str]]) -> str:
         2       -> 000002
         1       -> 000001
     """
+    if version is None or version == LATEST_VERSION:
+        return LATEST_VERSION
+    if type(version) is int:
+        if 0 <= version < 1024:
+            return _VERSION_SK_LUT[version]
+    elif type(version) is str and version.isdecimal():
+        number = int(version)
+        if number < 1024:
+            return _VERSION_SK_LUT[number]
     return encode_version(version).zfill(VERSION_ZFILL)
 
 
+def decode_version_sk(sk: str) -> str:
+    """
+    Get the human readable version from the Dynamodb sort key.
+
+    Example::
+
+        LATEST  -> LATEST
+        000001  -> 1
+    """
+    if sk == LATEST_VERSION:
+        return LATEST_VERSION
+    return str(int(sk))
+
+
+_ALIAS_PK_PREFIX = "__"
+_ALIAS_PK_SUFFIX = "-alias"
+_ALIAS_PK_PREFIX_LEN = len(_ALIAS_PK_PREFIX)
+_ALIAS_PK_SUFFIX_LEN = len(_ALIAS_PK_SUFFIX)
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
 def encode_alias_pk(name: str) -> str:
     """
     Get the Dynamodb partition key of an alias.
 
     :param name: artifact name
     """
-    return f"__{name}-alias"
+    return f"{_ALIAS_PK_PREFIX}{name}{_ALIAS_PK_SUFFIX}"
 
 
 class Base(Model):
@@ -72,6 +111,30 @@ class Base(Model):
         default=LATEST_VERSION,
     )
 
+    @classmethod
+    def _fast_new(cls, attribute_values: T.Dict[str, T.Any]):
+        """
+        Create an instance without going through ``Model.__init__``, which
+        sets the values one by one via the attribute descriptors. The caller
+        is responsible for giving all the attribute values, including the
+        defaults. Like ``Model.__init__``, unknown attribute names are
+        rejected and ``None`` values are not stored.
+        """
+        if not attribute_values.keys() <= cls.get_attributes().keys():
+            raise ValueError(
+                f"Attribute {set(attribute_values) - set(cls.get_attributes())} "
+                f"specified does not exist"
+            )
+        attribute_values = {
+            key: value for key, value in attribute_values.items() if value is not None
+        }
+        # the discriminator value is set by Model.__init__ only
+        if cls._get_discriminator_attribute() is not None:  # pragma: no cover
+            return cls(**attribute_values)
+        obj = cls.__new__(cls)
+        obj.attribute_values = attribute_values
+        return obj
+
 
 class Artifact(Base):
     """
@@ -83,6 +146,16 @@ class Artifact(Base):
         default=False,
     )
     sha256: T.Union[str, UnicodeAttribute] = UnicodeAttribute()
+    # atomic counter of the last published version, only on the LATEST item
+    latest_version_number: T.Optional[
+        T.Union[int, NumberAttribute]
+    ] = NumberAttribute(
+        null=True,
+    )
+    # idempotency key of the last publish, only on the LATEST item
+    idempotency_key: T.Optional[T.Union[str, UnicodeAttribute]] = UnicodeAttribute(
+        null=True,
+    )
 
     @classmethod
     def new(
@@ -90,10 +163,13 @@ class Artifact(Base):
         name: str,
         version: T.Optional[T.Union[int, str]] = None,
     ) -> "Artifact":
-        if version is None:
-            return cls(pk=name)
-        else:
-            return cls(pk=name, sk=encode_version_sk(version))
+        return cls._fast_new(
+            {
+                "pk": name,
+                "sk": encode_version_sk(version),
+                "is_deleted": False,
+            }
+        )
 
     @property
     def name(self) -> str:
@@ -101,7 +177,7 @@ class Artifact(Base):
 
     @property
     def version(self) -> str:
-        return self.sk.lstrip("0")
+        return decode_version_sk(self.sk)
 
     def to_dict(self) -> dict:
         return {
@@ -145,17 +221,20 @@ class Alias(Base):
             secondary_version = encode_version_sk(secondary_version)
             if version == secondary_version:
                 raise ValueError
-        return cls(
-            pk=encode_alias_pk(name),
-            sk=alias,
-            version=version,
-            secondary_version=secondary_version,
-            secondary_version_weight=secondary_version_weight,
+        return cls._fast_new(
+            {
+                "pk": encode_alias_pk(name),
+                "sk": alias,
+                "update_at": get_utc_now(),
+                "version": version,
+                "secondary_version": secondary_version,
+                "secondary_version_weight": secondary_version_weight,
+            }
         )
 
     @property
     def name(self) -> str:
-        return "-".join(self.pk.split("-")[:-1])[2:]
+        return self.pk[_ALIAS_PK_PREFIX_LEN:-_ALIAS_PK_SUFFIX_LEN]
 
     @property
     def alias(self) -> str:
@@ -165,12 +244,12 @@ class Alias(Base):
         if self.secondary_version is None:
             secondary_version = None
         else:
-            secondary_version = self.secondary_version.lstrip("0")
+            secondary_version = decode_version_sk(self.secondary_version)
         return {
             "name": self.name,
             "alias": self.alias,
             "update_at": self.update_at,
-            "version": self.version.lstrip("0"),
+            "version": decode_version_sk(self.version),
             "secondary_version": secondary_version,
             "secondary_version_weight": self.secondary_version_weight,
         }
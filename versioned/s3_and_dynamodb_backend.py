@@ -2,23 +2,63 @@
 
 import typing as T
 
+import time
 import random
+import functools
+import itertools
+import threading
 import dataclasses
 from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from boto_session_manager import BotoSesManager
-from s3pathlib import S3Path, context
+from s3pathlib import S3Path
 from func_args import NOTHING
 from pynamodb.connection import Connection
+from pynamodb.exceptions import UpdateError, TransactWriteError
+from pynamodb.transactions import TransactWrite
 
 from . import constants
 from . import dynamodb
 from . import exc
 from .compat import cached_property
-from .bootstrap import bootstrap
-from .vendor.hashes import hashes
-
-hashes.use_sha256()
+from .bootstrap import bootstrap, attach_boto_session
+from .utils import (
+    get_content_sha256,
+    write_content,
+    read_content,
+    copy_content,
+    list_dir_names,
+)
+
+_CONDITIONAL_CHECK_FAILED = "ConditionalCheckFailedException"
+_TRANSACTION_CANCELED = "TransactionCanceledException"
+_CONDITION_CHECK_FAILED_REASON = "ConditionalCheckFailed"
+
+# don't run more concurrent requests than the client connection pool size
+_MAX_WORKERS = constants.MAX_POOL_CONNECTIONS
+# a lost race to seed the version counter starts the allocation over, the
+# counter exists afterwards, so the next attempt normally succeeds
+_ALLOCATE_VERSION_NUMBER_ATTEMPTS = 3
+# max number of entries in the Repository.cache_ttl LRU cache
+_CACHE_MAXSIZE = 1024
+# valid secondary_version_weight values
+_WEIGHT_RANGE = range(0, 100)
+
+# the fixed condition expressions and update actions are built once, building
+# one takes a few microseconds. They only refer to the attribute names, so they
+# work with all the table bound model classes
+_IS_DELETED = dynamodb.Artifact.is_deleted == True
+_IS_NOT_DELETED = dynamodb.Artifact.is_deleted == False
+_SOFT_DELETE = dynamodb.Artifact.is_deleted.set(True)
+_UNDELETE = dynamodb.Artifact.is_deleted.set(False)
+_VERSION_DOES_NOT_EXIST = dynamodb.Artifact.sk.does_not_exist()
+_SHA256_DOES_NOT_EXIST = dynamodb.Artifact.sha256.does_not_exist()
+_COUNTER_EXISTS = dynamodb.Artifact.latest_version_number.exists()
+_COUNTER_INCREMENT = dynamodb.Artifact.latest_version_number.add(1)
+_IDEMPOTENCY_KEY_DOES_NOT_EXIST = dynamodb.Artifact.idempotency_key.does_not_exist()
+_IDEMPOTENCY_KEY_REMOVE = dynamodb.Artifact.idempotency_key.remove()
 
 
 @dataclasses.dataclass
@@ -49,11 +89,14 @@ class Artifact:
         """
         return S3Path(self.s3uri)
 
-    def get_content(self, bsm: BotoSesManager) -> bytes:
+    def get_content(self, bsm: T.Optional[BotoSesManager] = None) -> bytes:
         """
         Get the content of this artifact version.
+
+        :param bsm: when not given, use the boto session attached by
+            :meth:`Repository.connect_boto_session` or :meth:`Repository.bootstrap`.
         """
-        return self.s3path.read_bytes(bsm=bsm)
+        return read_content(self.s3path, bsm=bsm)
 
 
 @dataclasses.dataclass
@@ -90,11 +133,14 @@ class Alias:
         """
         return S3Path(self.version_s3uri)
 
-    def get_version_content(self, bsm: BotoSesManager) -> bytes:
+    def get_version_content(self, bsm: T.Optional[BotoSesManager] = None) -> bytes:
         """
         Get the content of the primary artifact version of this alias.
+
+        :param bsm: when not given, use the boto session attached by
+            :meth:`Repository.connect_boto_session` or :meth:`Repository.bootstrap`.
         """
-        return self.s3path_version.read_bytes(bsm=bsm)
+        return read_content(self.s3path_version, bsm=bsm)
 
     @property
     def s3path_secondary_version(self) -> S3Path:
@@ -103,30 +149,132 @@ class Alias:
         """
         return S3Path(self.secondary_version_s3uri)
 
-    def get_secondary_version_content(self, bsm: BotoSesManager) -> bytes:
+    def get_secondary_version_content(self, bsm: T.Optional[BotoSesManager] = None) -> bytes:
         """
         Get the content of the secondary artifact version of this alias.
+
+        :param bsm: when not given, use the boto session attached by
+            :meth:`Repository.connect_boto_session` or :meth:`Repository.bootstrap`.
         """
-        return self.s3path_secondary_version.read_bytes(bsm=bsm)
+        return read_content(self.s3path_secondary_version, bsm=bsm)
 
-    @cached_property
-    def _version_weight(self) -> int:
+    def get_both_version_content(
+        self,
+        bsm: T.Optional[BotoSesManager] = None,
+    ) -> T.Tuple[bytes, T.Optional[bytes]]:
+        """
+        Get the content of both the primary and the secondary artifact version
+        of this alias, the two objects are downloaded concurrently. The
+        secondary content is ``None`` if this alias has no secondary version.
+
+        :param bsm: when not given, use the boto session attached by
+            :meth:`Repository.connect_boto_session` or :meth:`Repository.bootstrap`.
+        """
+        if self.secondary_version_s3uri is None:
+            return self.get_version_content(bsm=bsm), None
+        if bsm is not None:
+            bsm.s3_client  # create the client once, before the threads share it
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future = executor.submit(self.get_secondary_version_content, bsm)
+            content = self.get_version_content(bsm=bsm)
+            return content, future.result()
+
+    @property
+    def _primary_threshold(self) -> float:
+        """
+        The probability of routing to the primary version.
+        """
         if self.secondary_version_weight is None:
-            return 100
+            return 1.0
         else:
-            return 100 - self.secondary_version_weight
+            return (100 - self.secondary_version_weight) / 100
 
     def random_artifact(self) -> str:
         """
         Randomly return either the primary or secondary artifact version s3uri
         based on the weight.
         """
-        if random.randint(1, 100) <= self._version_weight:
+        threshold = self._primary_threshold
+        # no secondary version, or a 0 weight one, skip the random draw
+        if threshold >= 1.0 or random.random() < threshold:
             return self.version_s3uri
         else:
             return self.secondary_version_s3uri
 
 
+# the model classes are cached, so pynamodb builds the class and the
+# underlying connection only once per table
+@functools.lru_cache(maxsize=32, typed=True)
+def _get_artifact_class(
+    dynamodb_table_name: str,
+    aws_region: str,
+) -> T.Type[dynamodb.Artifact]:
+    class Artifact(dynamodb.Artifact):
+        class Meta:
+            table_name = dynamodb_table_name
+            region = aws_region
+            max_pool_connections = constants.MAX_POOL_CONNECTIONS
+
+    return Artifact
+
+
+@functools.lru_cache(maxsize=32, typed=True)
+def _get_alias_class(
+    dynamodb_table_name: str,
+    aws_region: str,
+) -> T.Type[dynamodb.Alias]:
+    class Alias(dynamodb.Alias):
+        class Meta:
+            table_name = dynamodb_table_name
+            region = aws_region
+            max_pool_connections = constants.MAX_POOL_CONNECTIONS
+
+    return Alias
+
+
+# boto session the cached model classes were last refreshed for by
+# Repository.connect_boto_session()
+_connected_boto_ses: T.Optional[T.Any] = None
+_CONNECT_LOCK = threading.Lock()
+
+
+# max number of items in a BatchWriteItem request
+_BATCH_WRITE_SIZE = 25
+# number of parallel scan segments of purge_all
+_SCAN_SEGMENTS = 8
+
+
+def _batch_delete(
+    model_class: T.Type[dynamodb.Base],
+    items: T.Iterable[dynamodb.Base],
+    max_workers: int = 8,
+):
+    """
+    Delete the items with concurrent ``BatchWriteItem`` requests. pynamodb's
+    ``batch_write`` sends its 25 items requests one after another, this sends
+    up to ``max_workers`` of them at the same time, while the items are still
+    being read.
+    """
+
+    def delete(chunk: T.List[dynamodb.Base]):
+        with model_class.batch_write() as batch:
+            for item in chunk:
+                batch.delete(item)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = list()
+        chunk = list()
+        for item in items:
+            chunk.append(item)
+            if len(chunk) == _BATCH_WRITE_SIZE:
+                futures.append(executor.submit(delete, chunk))
+                chunk = list()
+        if chunk:
+            futures.append(executor.submit(delete, chunk))
+        for future in futures:
+            future.result()
+
+
 @dataclasses.dataclass
 class Repository:
     """
@@ -137,6 +285,10 @@ class Repository:
     :param s3_prefix: the s3 prefix (folder path) of the artifact store.
     :param dynamodb_table_name: the dynamodb table name of the artifact metadata store.
     :param suffix: the file extension suffix of the artifact binary.
+    :param cache_ttl: seconds to keep the result of :meth:`get_artifact_version`
+        and :meth:`get_alias` in a process local cache, ``0`` disables the
+        cache. Changes made through this repository object invalidate the
+        cache, changes made by others are seen after ``cache_ttl`` seconds.
     """
 
     aws_region: str = dataclasses.field()
@@ -144,6 +296,50 @@ class Repository:
     s3_prefix: str = dataclasses.field(default=constants.S3_PREFIX)
     dynamodb_table_name: str = dataclasses.field(default=constants.DYNAMODB_TABLE_NAME)
     suffix: str = dataclasses.field(default="")
+    cache_ttl: float = dataclasses.field(default=0)
+
+    _cache: "OrderedDict[tuple, tuple]" = dataclasses.field(
+        default_factory=OrderedDict,
+        init=False,
+        repr=False,
+        compare=False,
+    )
+
+    def _cache_get(self, key: tuple):
+        """
+        Get a copy of the cached value, so callers can't change the cache,
+        ``None`` if not cached or expired. A hit makes the entry the most
+        recently used one.
+        """
+        if self.cache_ttl <= 0:
+            return None
+        try:
+            expire, value = self._cache[key]
+        except KeyError:
+            return None
+        if time.monotonic() >= expire:
+            self._cache.pop(key, None)
+            return None
+        self._cache.move_to_end(key)
+        return dataclasses.replace(value)
+
+    def _cache_set(self, key: tuple, value):
+        """
+        Cache a copy of the value, the least recently used entry is evicted
+        beyond ``_CACHE_MAXSIZE`` entries.
+        """
+        if self.cache_ttl <= 0:
+            return
+        self._cache[key] = (
+            time.monotonic() + self.cache_ttl,
+            dataclasses.replace(value),
+        )
+        self._cache.move_to_end(key)
+        if len(self._cache) > _CACHE_MAXSIZE:
+            self._cache.popitem(last=False)
+
+    def _cache_pop(self, key: tuple):
+        self._cache.pop(key, None)
 
     @property
     def s3dir_artifact_store(self) -> S3Path:
@@ -159,11 +355,31 @@ class Repository:
         :param name: artifact name.
         :param version: artifact version. If ``None``, return the latest version.
         """
-        return self.s3dir_artifact_store.joinpath(
+        return self._s3dir_artifact_store.joinpath(
             name,
             f"{dynamodb.encode_version_sk(version)}{self.suffix}",
         )
 
+    # S3Path.joinpath returns a new object, the cached one is never mutated
+    @cached_property
+    def _s3dir_artifact_store(self) -> S3Path:
+        return self.s3dir_artifact_store
+
+    @cached_property
+    def _s3uri_artifact_store(self) -> str:
+        return self._s3dir_artifact_store.uri
+
+    def _get_artifact_s3uri(self, name: str, version: str) -> str:
+        """
+        Same as ``get_artifact_s3path(name, version).uri``, but without
+        building the intermediate ``S3Path`` objects, used when converting
+        many DynamoDB items.
+        """
+        return (
+            f"{self._s3uri_artifact_store}{name}/"
+            f"{dynamodb.encode_version_sk(version)}{self.suffix}"
+        )
+
     def bootstrap(
         self,
         bsm: BotoSesManager,
@@ -184,50 +400,53 @@ class Repository:
 
     @property
     def _artifact_class(self) -> T.Type[dynamodb.Artifact]:
-        class Artifact(dynamodb.Artifact):
-            class Meta:
-                table_name = self.dynamodb_table_name
-                region = self.aws_region
-
-        return Artifact
+        return _get_artifact_class(self.dynamodb_table_name, self.aws_region)
 
     @property
     def _alias_class(self) -> T.Type[dynamodb.Alias]:
-        class Alias(dynamodb.Alias):
-            class Meta:
-                table_name = self.dynamodb_table_name
-                region = self.aws_region
-
-        return Alias
+        return _get_alias_class(self.dynamodb_table_name, self.aws_region)
 
+    # build the public objects from the item attributes directly, instead of
+    # going through to_dict() and keyword unpacking, it runs for every item
+    # of the list methods
     def _get_artifact_object(
         self,
         artifact: dynamodb.Artifact,
     ) -> Artifact:
-        dct = artifact.to_dict()
-        dct["s3uri"] = self.get_artifact_s3path(
-            name=artifact.name,
-            version=artifact.version,
-        ).uri
-        return Artifact(**dct)
+        name = artifact.pk
+        version = artifact.version
+        return Artifact(
+            name=name,
+            version=version,
+            update_at=artifact.update_at,
+            s3uri=self._get_artifact_s3uri(name=name, version=version),
+            sha256=artifact.sha256,
+        )
 
     def _get_alias_object(
         self,
         alias: dynamodb.Alias,
     ) -> Alias:
-        dct = alias.to_dict()
-        dct["version_s3uri"] = self.get_artifact_s3path(
-            name=alias.name,
-            version=alias.version,
-        ).uri
-        if alias.secondary_version is None:
-            dct["secondary_version_s3uri"] = None
+        name = alias.name
+        secondary_version = alias.secondary_version
+        if secondary_version is None:
+            secondary_version_s3uri = None
         else:
-            dct["secondary_version_s3uri"] = self.get_artifact_s3path(
-                name=alias.name,
-                version=alias.secondary_version,
-            ).uri
-        return Alias(**dct)
+            secondary_version_s3uri = self._get_artifact_s3uri(
+                name=name,
+                version=secondary_version,
+            )
+            secondary_version = dynamodb.decode_version_sk(secondary_version)
+        return Alias(
+            name=name,
+            alias=alias.sk,
+            update_at=alias.update_at,
+            version=dynamodb.decode_version_sk(alias.version),
+            secondary_version=secondary_version,
+            secondary_version_weight=alias.secondary_version_weight,
+            version_s3uri=self._get_artifact_s3uri(name=name, version=alias.version),
+            secondary_version_s3uri=secondary_version_s3uri,
+        )
 
     def connect_boto_session(self, bsm: BotoSesManager):
         """
@@ -235,9 +454,20 @@ class Repository:
 
         :param bsm: ``boto_session_manager.BotoSesManager`` object.
         """
-        context.attach_boto_session(bsm.boto_ses)
-        with bsm.awscli():
-            Connection()
+        global _connected_boto_ses
+        attach_boto_session(bsm)
+        # bootstrap() attaches the boto session to s3pathlib too, so it is
+        # tracked here on its own: the cached model classes are reused only
+        # if they were refreshed for this very boto session
+        with _CONNECT_LOCK:
+            if _connected_boto_ses is bsm.boto_ses:
+                return
+            # the cached model classes hold a client bound to the old credential
+            _get_artifact_class.cache_clear()
+            _get_alias_class.cache_clear()
+            with bsm.awscli():
+                Connection()
+            _connected_boto_ses = bsm.boto_ses
 
     # ------------------------------------------------------------------------------
     # Artifact
@@ -245,7 +475,7 @@ class Repository:
     def put_artifact(
         self,
         name: str,
-        content: bytes,
+        content: T.Union[bytes, T.BinaryIO],
         content_type: str = NOTHING,
         metadata: T.Dict[str, str] = NOTHING,
         tags: T.Dict[str, str] = NOTHING,
@@ -254,16 +484,20 @@ class Repository:
         Create / Update artifact to the latest.
 
         :param name: artifact name.
-        :param content: binary artifact content.
+        :param content: binary artifact content, or a seekable binary file
+            object, it is hashed and uploaded chunk by chunk so large
+            artifacts don't have to be loaded in memory.
         :param metadata: optional metadata of the s3 object.
         :param tags: optional tags of the s3 object.
         """
         artifact = self._artifact_class.new(name=name)
-        artifact_sha256 = hashes.of_bytes(content)
+        artifact_sha256 = get_content_sha256(content)
         artifact.sha256 = artifact_sha256
         s3path = self.get_artifact_s3path(name=name, version=constants.LATEST_VERSION)
 
-        # do nothing if the content is not changed
+        # do nothing if the content is not changed, exists() is a single
+        # HeadObject call and keeps the response, reading the metadata and
+        # last modified time from it doesn't send another request
         if s3path.exists():
             if s3path.metadata["artifact_sha256"] == artifact_sha256:
                 artifact.update_at = s3path.last_modified_at
@@ -275,15 +509,45 @@ class Repository:
         )
         if metadata is not NOTHING:
             final_metadata.update(metadata)
-        s3path.write_bytes(
+        write_content(
+            s3path,
             content,
             metadata=final_metadata,
             content_type=content_type,
             tags=tags,
         )
         s3path.head_object()
-        artifact.update_at = s3path.last_modified_at
-        artifact.save()
+        update_at = s3path.last_modified_at
+        # update instead of put, so the published version counter is kept,
+        # the same content written again still moves update_at forward to
+        # the last modified time of the S3 object
+        Artifact = self._artifact_class
+        try:
+            artifact.update(
+                actions=[
+                    Artifact.update_at.set(update_at),
+                    Artifact.sha256.set(artifact_sha256),
+                    _UNDELETE,
+                ],
+                condition=(
+                    _SHA256_DOES_NOT_EXIST
+                    | (Artifact.sha256 != artifact_sha256)
+                    | _IS_DELETED
+                    | (Artifact.update_at < update_at)
+                ),
+            )
+        except UpdateError as e:
+            # a concurrent put_artifact already recorded the same content at
+            # the same time or later, return what is stored
+            if e.cause_response_code != _CONDITIONAL_CHECK_FAILED:
+                raise  # pragma: no cover
+            artifact = Artifact.get(
+                name,
+                constants.LATEST_VERSION,
+                consistent_read=True,
+                attributes_to_get=["pk", "sk", "update_at", "sha256"],
+            )
+        self._cache_pop(("artifact", name, constants.LATEST_VERSION))
         return self._get_artifact_object(artifact=artifact)
 
     def _get_artifact_dynamodb_item(
@@ -291,11 +555,13 @@ class Repository:
         artifact_class: T.Type[dynamodb.Artifact],
         name: str,
         version: T.Union[int, str],
+        attributes_to_get: T.Optional[T.List[str]] = None,
     ) -> dynamodb.Artifact:
         try:
             artifact = artifact_class.get(
                 hash_key=name,
                 range_key=dynamodb.encode_version_sk(version),
+                attributes_to_get=attributes_to_get,
             )
             if artifact.is_deleted:
                 raise exc.ArtifactNotFoundError(
@@ -305,6 +571,44 @@ class Repository:
         except artifact_class.DoesNotExist:
             raise exc.ArtifactNotFoundError(f"name = {name!r}, version = {version!r}")
 
+    def _get_artifact_dynamodb_items(
+        self,
+        artifact_class: T.Type[dynamodb.Artifact],
+        name: str,
+        versions: T.Iterable[T.Union[int, str]],
+        consistent_read: bool = False,
+        attributes_to_get: T.Optional[T.List[str]] = None,
+    ) -> T.List[dynamodb.Artifact]:
+        """
+        Get many artifact versions in as few round trips as possible. It uses
+        ``BatchGetItem`` under the hood, pynamodb sends up to 100 keys per
+        request and re-submits the ``UnprocessedKeys``.
+
+        The returned items are in the same order as the ``versions`` argument.
+
+        :param attributes_to_get: the projection, it must include ``pk``,
+            ``sk`` and ``is_deleted``.
+        """
+        sk_list = [dynamodb.encode_version_sk(version) for version in versions]
+        artifact_mapper = {
+            artifact.sk: artifact
+            # BatchGetItem rejects duplicated keys, e.g. versions 1 and "000001"
+            for artifact in artifact_class.batch_get(
+                [(name, sk) for sk in dict.fromkeys(sk_list)],
+                consistent_read=consistent_read,
+                attributes_to_get=attributes_to_get,
+            )
+        }
+        artifact_list = list()
+        for sk in sk_list:
+            artifact = artifact_mapper.get(sk)
+            if artifact is None or artifact.is_deleted:
+                raise exc.ArtifactNotFoundError(
+                    f"name = {name!r}, version = {dynamodb.encode_version(sk)!r}"
+                )
+            artifact_list.append(artifact)
+        return artifact_list
+
     def get_artifact_version(
         self,
         name: str,
@@ -318,53 +622,203 @@ class Repository:
         """
         if version is None:
             version = constants.LATEST_VERSION
-        artifact = self._get_artifact_dynamodb_item(
-            self._artifact_class,
-            name=name,
-            version=version,
-        )
-        return self._get_artifact_object(artifact=artifact)
+        cache_key = ("artifact", name, dynamodb.encode_version_sk(version))
+        artifact = self._cache_get(cache_key)
+        if artifact is None:
+            artifact = self._get_artifact_object(
+                artifact=self._get_artifact_dynamodb_item(
+                    self._artifact_class,
+                    name=name,
+                    version=version,
+                )
+            )
+            self._cache_set(cache_key, artifact)
+        return artifact
+
+    def get_artifact_versions(
+        self,
+        name: str,
+        versions: T.Iterable[T.Optional[T.Union[int, str]]],
+        consistent_read: bool = False,
+    ) -> T.List[Artifact]:
+        """
+        Return the information about many artifact versions at once. It is
+        much faster than calling :meth:`get_artifact_version` in a loop.
+
+        :param name: artifact name.
+        :param versions: list of artifact versions. ``None`` means the latest version.
+        :param consistent_read: use strongly consistent reads, it costs twice
+            the read capacity.
+
+        :return: list of artifact versions, in the same order as ``versions``.
+        """
+        return [
+            self._get_artifact_object(artifact=artifact)
+            for artifact in self._get_artifact_dynamodb_items(
+                self._artifact_class,
+                name=name,
+                versions=versions,
+                consistent_read=consistent_read,
+            )
+        ]
+
+    def iter_artifact_versions(
+        self,
+        name: str,
+        limit: T.Optional[int] = None,
+    ) -> T.Iterator[Artifact]:
+        """
+        Iterate artifact versions. The latest version is always the first item.
+        And the newer version comes first. Items are fetched page by page
+        from DynamoDB as you iterate.
+
+        :param name: artifact name.
+        :param limit: stop after this many versions, ``None`` means no limit.
+        """
+        for artifact in self._artifact_class.query(
+            hash_key=name,
+            scan_index_forward=False,
+            filter_condition=_IS_NOT_DELETED,
+            limit=limit,
+            # only fetch what the public Artifact object needs
+            attributes_to_get=["pk", "sk", "update_at", "sha256"],
+        ):
+            yield self._get_artifact_object(artifact)
 
     def list_artifact_versions(
         self,
         name: str,
+        limit: T.Optional[int] = None,
     ) -> T.List[Artifact]:
         """
         Return a list of artifact versions. The latest version is always the first item.
         And the newer version comes first.
 
         :param name: artifact name.
+        :param limit: return at most this many versions, ``None`` means no limit.
+        """
+        return list(self.iter_artifact_versions(name=name, limit=limit))
+
+    def _allocate_version_number(
+        self,
+        name: str,
+        idempotency_key: T.Optional[str] = None,
+    ) -> T.Tuple[dynamodb.Artifact, bool]:
+        """
+        Atomically increase the ``latest_version_number`` counter of the LATEST
+        item, concurrent publishes never get the same number. Return the
+        updated LATEST item, and whether it is a retry of the last publish.
+
+        Artifacts published before the counter existed don't have it, in this
+        case it is seeded from the last published version.
+
+        If the ``idempotency_key`` is the same as the one of the last publish,
+        the counter is not increased, the number of the last publish is returned.
         """
         Artifact = self._artifact_class
-        return [
-            self._get_artifact_object(artifact=artifact)
-            for artifact in Artifact.query(
-                hash_key=name,
-                scan_index_forward=False,
-                filter_condition=Artifact.is_deleted == False,
+        # only the key of the very last publish is kept
+        key_actions = [_IDEMPOTENCY_KEY_REMOVE]
+        condition = _COUNTER_EXISTS
+        if idempotency_key is not None:
+            key_actions = [Artifact.idempotency_key.set(idempotency_key)]
+            condition = condition & (
+                _IDEMPOTENCY_KEY_DOES_NOT_EXIST
+                | (Artifact.idempotency_key != idempotency_key)
             )
-        ]
+        for attempt in range(1, _ALLOCATE_VERSION_NUMBER_ATTEMPTS + 1):
+            latest = Artifact.new(name=name)
+            try:
+                latest.update(
+                    actions=[_COUNTER_INCREMENT] + key_actions,
+                    condition=condition,
+                )
+                return latest, False
+            except UpdateError as e:
+                if e.cause_response_code != _CONDITIONAL_CHECK_FAILED:
+                    raise  # pragma: no cover
+
+            if idempotency_key is not None:
+                # the condition also fails if the last publish used the same key
+                try:
+                    latest = Artifact.get(
+                        hash_key=name,
+                        range_key=constants.LATEST_VERSION,
+                        consistent_read=True,
+                    )
+                except Artifact.DoesNotExist:
+                    raise exc.ArtifactNotFoundError(f"name = {name!r}")
+                if (
+                    latest.latest_version_number is not None
+                    and latest.idempotency_key == idempotency_key
+                ):
+                    return latest, True
+
+            artifacts = list(
+                Artifact.query(
+                    hash_key=name,
+                    scan_index_forward=False,
+                    limit=2,
+                    attributes_to_get=["pk", "sk"],
+                )
+            )
+            if len(artifacts) == 0:
+                raise exc.ArtifactNotFoundError(f"name = {name!r}")
+            elif len(artifacts) == 1:
+                last_version_number = 0
+            else:
+                last_version_number = int(artifacts[1].version)
+            try:
+                latest.update(
+                    actions=[
+                        Artifact.latest_version_number.set(last_version_number + 1)
+                    ]
+                    + key_actions,
+                    condition=(
+                        Artifact.pk.exists()
+                        & Artifact.latest_version_number.does_not_exist()
+                    ),
+                )
+                return latest, False
+            except UpdateError as e:
+                if (
+                    e.cause_response_code != _CONDITIONAL_CHECK_FAILED
+                    or attempt == _ALLOCATE_VERSION_NUMBER_ATTEMPTS
+                ):
+                    raise
+            # another publish seeded the counter in the meantime, start over
 
     def publish_artifact_version(
         self,
         name: str,
+        idempotency_key: T.Optional[str] = None,
     ) -> Artifact:
         """
         Creates a version from the latest artifact. Use versions to create an
         immutable snapshot of your latest artifact.
 
         :param name: artifact name.
+        :param idempotency_key: optional unique key of this publish. If it is
+            the same as the key of the last publish, for example when the call
+            is retried after a network error, no new version is created and
+            the version of the last publish is returned.
         """
         Artifact = self._artifact_class
-        artifacts = list(
-            Artifact.query(hash_key=name, scan_index_forward=False, limit=2)
+        latest, is_retry = self._allocate_version_number(
+            name=name,
+            idempotency_key=idempotency_key,
         )
-        if len(artifacts) == 0:
-            raise exc.ArtifactNotFoundError(f"name = {name!r}")
-        elif len(artifacts) == 1:
-            new_version = dynamodb.encode_version(1)
-        else:
-            new_version = str(int(artifacts[1].version) + 1)
+        new_version = str(latest.latest_version_number)
+        if is_retry:
+            # the last publish may have failed before saving the version
+            try:
+                artifact = Artifact.get(
+                    hash_key=name,
+                    range_key=dynamodb.encode_version_sk(new_version),
+                    consistent_read=True,
+                )
+                return self._get_artifact_object(artifact=artifact)
+            except Artifact.DoesNotExist:
+                pass
 
         # copy artifact from latest to the new version
         s3path_old = self.get_artifact_s3path(
@@ -372,14 +826,16 @@ class Repository:
             version=constants.LATEST_VERSION,
         )
         s3path_new = self.get_artifact_s3path(name=name, version=new_version)
-        s3path_old.copy_to(s3path_new)
-        s3path_new.head_object()
+        # the copy result has the last modified time, no need to HeadObject
+        update_at = copy_content(s3path_old, s3path_new)
 
         # create artifact object
         artifact = Artifact.new(name=name, version=new_version)
-        artifact.sha256 = artifacts[0].sha256
-        artifact.update_at = s3path_new.last_modified_at
-        artifact.save()
+        artifact.sha256 = latest.sha256
+        artifact.update_at = update_at
+        # the counter never hands out the same number twice, never overwrite
+        # an existing version in case the counter is out of sync anyway
+        artifact.save(condition=_VERSION_DOES_NOT_EXIST)
         return self._get_artifact_object(artifact=artifact)
 
     def delete_artifact_version(
@@ -400,11 +856,10 @@ class Repository:
         if version is None:
             version = constants.LATEST_VERSION
         res = Artifact.new(name=name, version=version).update(
-            actions=[
-                Artifact.is_deleted.set(True),
-            ],
+            actions=[_SOFT_DELETE],
         )
         # print(res)
+        self._cache_pop(("artifact", name, dynamodb.encode_version_sk(version)))
 
     def list_artifact_names(self) -> T.List[str]:
         """
@@ -412,11 +867,7 @@ class Repository:
 
         :return: list of artifact names.
         """
-        names = list()
-        for p in self.s3dir_artifact_store.iterdir():
-            if p.is_dir():
-                names.append(p.basename)
-        return names
+        return list_dir_names(self._s3dir_artifact_store)
 
     # ------------------------------------------------------------------------------
     # Alias
@@ -452,9 +903,10 @@ class Repository:
 
         if secondary_version is not None:
             secondary_version = dynamodb.encode_version(secondary_version)
-            if not isinstance(secondary_version_weight, int):
+            # exact type check, bool is a subclass of int
+            if type(secondary_version_weight) is not int:
                 raise TypeError("secondary_version_weight must be int")
-            if not (0 <= secondary_version_weight < 100):
+            if secondary_version_weight not in _WEIGHT_RANGE:
                 raise ValueError("secondary_version_weight must be 0 <= x < 100")
             if version == secondary_version:
                 raise ValueError(
@@ -462,20 +914,7 @@ class Repository:
                     f"cannot be the same!"
                 )
 
-        # ensure the artifact exists
         Artifact = self._artifact_class
-        self._get_artifact_dynamodb_item(
-            Artifact,
-            name=name,
-            version=version,
-        )
-        if secondary_version is not None:
-            self._get_artifact_dynamodb_item(
-                Artifact,
-                name=name,
-                version=secondary_version,
-            )
-
         Alias = self._alias_class
         alias = Alias.new(
             name=name,
@@ -484,9 +923,54 @@ class Repository:
             secondary_version=secondary_version,
             secondary_version_weight=secondary_version_weight,
         )
-        alias.save()
+        versions = [version]
+        if secondary_version is not None:
+            versions.append(secondary_version)
+
+        # ensure the artifact versions exist and save the alias in one
+        # transaction, an artifact version cannot be deleted in between
+        try:
+            with TransactWrite(connection=Alias._get_connection().connection) as tx:
+                for v in versions:
+                    tx.condition_check(
+                        Artifact,
+                        hash_key=name,
+                        range_key=dynamodb.encode_version_sk(v),
+                        condition=_IS_NOT_DELETED,
+                    )
+                tx.save(alias)
+        except TransactWriteError as e:
+            if e.cause_response_code != _TRANSACTION_CANCELED:
+                raise  # pragma: no cover
+            # cancellation reasons are in the same order as the transaction items
+            for v, reason in zip(versions, e.cancellation_reasons):
+                if (
+                    reason is not None
+                    and reason.code == _CONDITION_CHECK_FAILED_REASON
+                ):
+                    raise exc.ArtifactNotFoundError(
+                        f"name = {name!r}, version = {v!r}"
+                    )
+            raise  # pragma: no cover
+        self._cache_pop(("alias", name, alias.alias))
         return self._get_alias_object(alias=alias)
 
+    def _get_alias_dynamodb_item(
+        self,
+        name: str,
+        alias: str,
+        consistent_read: bool = False,
+    ) -> dynamodb.Alias:
+        Alias = self._alias_class
+        try:
+            return Alias.get(
+                hash_key=dynamodb.encode_alias_pk(name),
+                range_key=alias,
+                consistent_read=consistent_read,
+            )
+        except Alias.DoesNotExist:
+            raise exc.AliasNotFoundError(f"name = {name!r}, alias = {alias!r}")
+
     def get_alias(
         self,
         name: str,
@@ -498,16 +982,59 @@ class Repository:
         :param name: artifact name.
         :param alias: alias name. alias name cannot have hyphen
         """
-        Alias = self._alias_class
-        try:
-            return self._get_alias_object(
-                alias=Alias.get(
-                    hash_key=dynamodb.encode_alias_pk(name),
-                    range_key=alias,
+        cache_key = ("alias", name, alias)
+        ali = self._cache_get(cache_key)
+        if ali is not None:
+            return ali
+        ali = self._get_alias_object(
+            alias=self._get_alias_dynamodb_item(name=name, alias=alias),
+        )
+        self._cache_set(cache_key, ali)
+        return ali
+
+    def get_alias_with_artifact(
+        self,
+        name: str,
+        alias: str,
+        consistent_read: bool = False,
+    ) -> T.Tuple[Alias, Artifact, T.Optional[Artifact]]:
+        """
+        Return the alias, together with the artifact of its primary version
+        and the artifact of its secondary version (``None`` if not set).
+
+        It takes two DynamoDB requests, one to get the alias, and one
+        ``BatchGetItem`` to get all the artifact versions it points to. The
+        artifact versions depend on the alias, they cannot be read in the
+        same request. The items are not read in a transaction either.
+
+        :param name: artifact name.
+        :param alias: alias name. alias name cannot have hyphen
+        :param consistent_read: use strongly consistent reads and bypass the
+            ``cache_ttl`` cache, so a just updated alias is seen right away.
+            It costs twice the read capacity.
+        """
+        if consistent_read:
+            ali = self._get_alias_object(
+                alias=self._get_alias_dynamodb_item(
+                    name=name,
+                    alias=alias,
+                    consistent_read=True,
                 ),
             )
-        except Alias.DoesNotExist:
-            raise exc.AliasNotFoundError(f"name = {name!r}, alias = {alias!r}")
+        else:
+            ali = self.get_alias(name=name, alias=alias)
+        versions = [ali.version]
+        if ali.secondary_version is not None:
+            versions.append(ali.secondary_version)
+        artifacts = self.get_artifact_versions(
+            name=name,
+            versions=versions,
+            consistent_read=consistent_read,
+        )
+        if len(artifacts) == 1:
+            return ali, artifacts[0], None
+        else:
+            return ali, artifacts[0], artifacts[1]
 
     def list_aliases(
         self,
@@ -534,6 +1061,7 @@ class Repository:
         """
         res = self._alias_class.new(name=name, alias=alias).delete()
         # print(res)
+        self._cache_pop(("alias", name, alias))
 
     def purge_artifact_versions(
         self,
@@ -551,17 +1079,33 @@ class Repository:
         :param keep_last_n: number of versions to keep.
         :param purge_older_than_secs: seconds to keep.
         """
-        artifact_list = self.list_artifact_versions(name=name)
         purge_time = datetime.utcnow().replace(tzinfo=timezone.utc)
         expire = purge_time - timedelta(seconds=purge_older_than_secs)
-        deleted_artifact_list = list()
-        for artifact in artifact_list[keep_last_n + 1 :]:
-            if artifact.update_at < expire:
-                self.delete_artifact_version(
-                    name=name,
-                    version=artifact.version,
-                )
-                deleted_artifact_list.append(artifact)
+        # the latest and the last n versions are skipped without being kept
+        deleted_artifact_list = [
+            artifact
+            for artifact in itertools.islice(
+                self.iter_artifact_versions(name=name),
+                keep_last_n + 1,
+                None,
+            )
+            if artifact.update_at < expire
+        ]
+        # each soft delete is an independent UpdateItem, send them concurrently
+        if deleted_artifact_list:
+            with ThreadPoolExecutor(
+                max_workers=min(_MAX_WORKERS, len(deleted_artifact_list))
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        self.delete_artifact_version,
+                        name=name,
+                        version=artifact.version,
+                    )
+                    for artifact in deleted_artifact_list
+                ]
+                for future in futures:
+                    future.result()
         return purge_time, deleted_artifact_list
 
     def purge_artifact(
@@ -577,16 +1121,39 @@ class Repository:
         """
         s3path = self.get_artifact_s3path(name=name, version=constants.LATEST_VERSION)
         s3dir = s3path.parent
-        s3dir.delete()
 
         Artifact = self._artifact_class
         Alias = self._alias_class
-        with Artifact.batch_write() as batch:
-            for artifact in Artifact.query(hash_key=name):
-                batch.delete(artifact)
-        with Alias.batch_write() as batch:
-            for alias in Alias.query(hash_key=dynamodb.encode_alias_pk(name)):
-                batch.delete(alias)
+
+        # deleting an item only needs the key
+        def delete_artifacts():
+            _batch_delete(
+                Artifact,
+                Artifact.query(
+                    hash_key=name,
+                    attributes_to_get=["pk", "sk"],
+                ),
+            )
+
+        def delete_aliases():
+            _batch_delete(
+                Alias,
+                Alias.query(
+                    hash_key=dynamodb.encode_alias_pk(name),
+                    attributes_to_get=["pk", "sk"],
+                ),
+            )
+
+        # the S3 folder, the artifact and the alias partitions are independent
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(s3dir.delete),
+                executor.submit(delete_artifacts),
+                executor.submit(delete_aliases),
+            ]
+            for future in futures:
+                future.result()
+        self._cache.clear()
 
     def purge_all(self):
         """
@@ -594,8 +1161,26 @@ class Repository:
         This operation is irreversible. It will remove all related S3 artifacts
         and DynamoDB items.
         """
-        self.s3dir_artifact_store.delete()
         Artifact = self._artifact_class
-        with Artifact.batch_write() as batch:
-            for item in Artifact.scan():
-                batch.delete(item)
+
+        # the artifact and the alias items are in the same table, a scan
+        # reads both, only the keys are needed to delete them
+        def delete_segment(segment: int):
+            _batch_delete(
+                Artifact,
+                Artifact.scan(
+                    segment=segment,
+                    total_segments=_SCAN_SEGMENTS,
+                    attributes_to_get=["pk", "sk"],
+                ),
+                max_workers=_MAX_WORKERS // _SCAN_SEGMENTS,
+            )
+
+        # the S3 folder and the scan segments are independent
+        with ThreadPoolExecutor(max_workers=1 + _SCAN_SEGMENTS) as executor:
+            futures = [executor.submit(self.s3dir_artifact_store.delete)]
+            for segment in range(_SCAN_SEGMENTS):
+                futures.append(executor.submit(delete_segment, segment))
+            for future in futures:
+                future.result()
+        self._cache.clear()
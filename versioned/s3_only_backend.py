@@ -2,24 +2,35 @@
 
 import typing as T
 
-import json
 import random
+import functools
 import dataclasses
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 from boto_session_manager import BotoSesManager
 from s3pathlib import S3Path
 from func_args import NOTHING
 
 from . import exc
-from .compat import cached_property
+from .compat import cached_property, json_loads, json_dumps_bytes
 from .constants import (
     S3_PREFIX,
     LATEST_VERSION,
     VERSION_ZFILL,
     METADATA_KEY_ARTIFACT_SHA256,
+    MAX_POOL_CONNECTIONS,
 )
-from .vendor.hashes import hashes
+from .utils import (
+    get_content_sha256,
+    write_content,
+    read_content,
+    copy_content,
+    list_dir_names,
+)
+
+# valid secondary_version_weight values
+_WEIGHT_RANGE = range(0, 100)
 
 
 def encode_version(version: T.Optional[T.Union[int, str]]) -> str:
@@ -39,6 +50,12 @@ def encode_version(version: T.Optional[T.Union[int, str]]) -> str:
         return str(version).lstrip("0")
 
 
+_VERSION_MOD = 10**VERSION_ZFILL
+_LATEST_FILENAME_PREFIX = VERSION_ZFILL * "0"
+_LATEST_FILENAME = f"{_LATEST_FILENAME_PREFIX}_{LATEST_VERSION}"
+
+
+@functools.lru_cache(maxsize=4096, typed=True)
 def encode_filename(version: T.Optional[T.Union[int, str]]) -> str:
     """
     Encode version into file name so that we can leverage the feature that
@@ -55,17 +72,12 @@ def encode_filename(version: T.Optional[T.Union[int, str]]) -> str:
     """
     version = encode_version(version)
     if version == LATEST_VERSION:
-        return "{}_{}".format(
-            VERSION_ZFILL * "0",
-            LATEST_VERSION,
-        )
-    else:
-        return "{}_{}".format(
-            str(10**VERSION_ZFILL - int(version)).zfill(VERSION_ZFILL),
-            version.zfill(VERSION_ZFILL),
-        )
+        return _LATEST_FILENAME
+    number = int(version)
+    return f"{_VERSION_MOD - number:0{VERSION_ZFILL}d}_{number:0{VERSION_ZFILL}d}"
 
 
+@functools.lru_cache(maxsize=4096, typed=True)
 def decode_filename(version: str) -> str:
     """
     Inverse of :func:`encode_filename`.
@@ -78,7 +90,7 @@ def decode_filename(version: str) -> str:
         999998_000002 -> 2
         999999_000001 -> 1
     """
-    if version.startswith(VERSION_ZFILL * "0"):
+    if version.startswith(_LATEST_FILENAME_PREFIX):
         return LATEST_VERSION
     else:
         return str(int(version.split("_")[1]))
@@ -92,7 +104,8 @@ def validate_alias_name(alias: str):
         raise ValueError(f"alias name cannot be {LATEST_VERSION!r}.")
     if "-" in alias:
         raise ValueError("alias name cannot contain '-'.")
-    if alias[0].isalpha() is False:
+    # slice instead of index, an empty alias name must not raise IndexError
+    if alias[:1].isalpha() is False:
         raise ValueError("alias name must start with a alpha letter.")
 
 
@@ -116,14 +129,25 @@ class Artifact(Base):
     :param update_at: an utc datetime object when this artifact was updated,
         in string format
     :param s3uri: s3uri of the artifact version.
-    :param sha256: sha256 of the content of the artifact version.
+    :param sha256: sha256 of the content of the artifact version. ``None`` if
+        it is listed by ``list_artifact_versions(..., with_sha256=False)``.
     """
 
     name: str
     version: str
     update_at: str
     s3uri: str
-    sha256: str
+    sha256: T.Optional[str]
+
+    def to_dict(self) -> dict:
+        # dataclasses.asdict() deep copies every field, it is a flat record
+        return {
+            "name": self.name,
+            "version": self.version,
+            "update_at": self.update_at,
+            "s3uri": self.s3uri,
+            "sha256": self.sha256,
+        }
 
     @property
     def update_datetime(self) -> datetime:
@@ -143,7 +167,7 @@ class Artifact(Base):
         """
         Get the content of this artifact version.
         """
-        return self.s3path.read_bytes(bsm=bsm)
+        return read_content(self.s3path, bsm=bsm)
 
 
 @dataclasses.dataclass
@@ -171,6 +195,19 @@ class Alias(Base):
     version_s3uri: str
     secondary_version_s3uri: T.Optional[str]
 
+    def to_dict(self) -> dict:
+        # dataclasses.asdict() deep copies every field, it is a flat record
+        return {
+            "name": self.name,
+            "alias": self.alias,
+            "update_at": self.update_at,
+            "version": self.version,
+            "secondary_version": self.secondary_version,
+            "secondary_version_weight": self.secondary_version_weight,
+            "version_s3uri": self.version_s3uri,
+            "secondary_version_s3uri": self.secondary_version_s3uri,
+        }
+
     @property
     def update_datetime(self) -> datetime:
         """
@@ -189,7 +226,7 @@ class Alias(Base):
         """
         Get the content of the primary artifact version of this alias.
         """
-        return self.s3path_version.read_bytes(bsm=bsm)
+        return read_content(self.s3path_version, bsm=bsm)
 
     @property
     def s3path_secondary_version(self) -> S3Path:
@@ -202,21 +239,43 @@ class Alias(Base):
         """
         Get the content of the secondary artifact version of this alias.
         """
-        return self.s3path_secondary_version.read_bytes(bsm=bsm)
+        return read_content(self.s3path_secondary_version, bsm=bsm)
 
-    @cached_property
-    def _version_weight(self) -> int:
+    def get_both_version_content(
+        self,
+        bsm: BotoSesManager,
+    ) -> T.Tuple[bytes, T.Optional[bytes]]:
+        """
+        Get the content of both the primary and the secondary artifact version
+        of this alias, the two objects are downloaded concurrently. The
+        secondary content is ``None`` if this alias has no secondary version.
+        """
+        if self.secondary_version_s3uri is None:
+            return self.get_version_content(bsm=bsm), None
+        bsm.s3_client  # create the client once, before the threads share it
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future = executor.submit(self.get_secondary_version_content, bsm)
+            content = self.get_version_content(bsm=bsm)
+            return content, future.result()
+
+    @property
+    def _primary_threshold(self) -> float:
+        """
+        The probability of routing to the primary version.
+        """
         if self.secondary_version_weight is None:
-            return 100
+            return 1.0
         else:
-            return 100 - self.secondary_version_weight
+            return (100 - self.secondary_version_weight) / 100
 
     def random_artifact(self) -> str:
         """
         Randomly return either the primary or secondary artifact version s3uri
         based on the weight.
         """
-        if random.randint(1, 100) <= self._version_weight:
+        threshold = self._primary_threshold
+        # no secondary version, or a 0 weight one, skip the random draw
+        if threshold >= 1.0 or random.random() < threshold:
             return self.version_s3uri
         else:
             return self.secondary_version_s3uri
@@ -247,11 +306,16 @@ class Repository:
         """
         return S3Path(self.s3_bucket).joinpath(self.s3_prefix).to_dir()
 
+    # S3Path.joinpath returns a new object, the cached one is never mutated
+    @cached_property
+    def _s3dir_artifact_store(self) -> S3Path:
+        return self.s3dir_artifact_store
+
     def _get_artifact_s3dir(self, name: str) -> S3Path:
         """
         Example: ``s3://${s3_bucket}/${s3_prefix}/${name}/``
         """
-        return self.s3dir_artifact_store.joinpath(name).to_dir()
+        return self._s3dir_artifact_store.joinpath(name).to_dir()
 
     def _encode_basename(self, version: T.Optional[T.Union[int, str]] = None) -> str:
         return f"{encode_filename(version)}{self.suffix}"
@@ -273,7 +337,8 @@ class Repository:
         """
         Example: ``s3://${s3_bucket}/${s3_prefix}/${name}/versions/${encoded_version}${suffix}``
         """
-        return self._get_artifact_s3dir(name=name).joinpath(
+        return self._s3dir_artifact_store.joinpath(
+            name,
             "versions",
             self._encode_basename(version),
         )
@@ -282,7 +347,8 @@ class Repository:
         """
         Example: ``s3://${s3_bucket}/${s3_prefix}/${name}/aliases/${alias}.json``
         """
-        return self._get_artifact_s3dir(name=name).joinpath(
+        return self._s3dir_artifact_store.joinpath(
+            name,
             "aliases",
             f"{alias}.json",
         )
@@ -401,9 +467,10 @@ class Repository:
     ) -> Alias:
         try:
             s3path = self._get_alias_s3path(name=name, alias=alias)
-            s3path.head_object(bsm=bsm)
-            alias = Alias.from_dict(json.loads(s3path.read_text(bsm=bsm)))
-            alias.update_at = s3path.last_modified_at.isoformat()
+            # the GetObject response has the last modified time, no HeadObject
+            res = bsm.s3_client.get_object(Bucket=s3path.bucket, Key=s3path.key)
+            alias = Alias.from_dict(json_loads(res["Body"].read()))
+            alias.update_at = res["LastModified"].isoformat()
             return alias
         except Exception as e:
             error_msg = str(e)
@@ -421,7 +488,7 @@ class Repository:
         self,
         bsm: BotoSesManager,
         name: str,
-        content: bytes,
+        content: T.Union[bytes, T.BinaryIO],
         content_type: str = NOTHING,
         metadata: T.Dict[str, str] = NOTHING,
         tags: T.Dict[str, str] = NOTHING,
@@ -431,15 +498,19 @@ class Repository:
 
         :param bsm: ``boto_session_manager.BotoSesManager`` object.
         :param name: artifact name.
-        :param content: binary artifact content.
+        :param content: binary artifact content, or a seekable binary file
+            object, it is hashed and uploaded chunk by chunk so large
+            artifacts don't have to be loaded in memory.
         :param content_type: customize s3 content type.
         :param metadata: optional metadata of the s3 object.
         :param tags: optional tags of the s3 object.
         """
-        artifact_sha256 = hashes.of_bytes(content)
+        artifact_sha256 = get_content_sha256(content)
         s3path = self._get_artifact_s3path(name=name, version=LATEST_VERSION)
 
-        # do nothing if the content is not changed
+        # do nothing if the content is not changed, exists() is a single
+        # HeadObject call and keeps the response, reading the metadata and
+        # last modified time from it doesn't send another request
         if s3path.exists(bsm=bsm):
             if s3path.metadata[METADATA_KEY_ARTIFACT_SHA256] == artifact_sha256:
                 return Artifact(
@@ -459,7 +530,8 @@ class Repository:
             final_metadata.update(metadata)
 
         # write artifact to S3
-        s3path.write_bytes(
+        write_content(
+            s3path,
             content,
             metadata=final_metadata,
             content_type=content_type,
@@ -495,10 +567,35 @@ class Repository:
             version=version,
         )
 
+    def _get_artifact_object_from_s3path(
+        self,
+        bsm: BotoSesManager,
+        name: str,
+        s3path: S3Path,
+        with_sha256: bool = True,
+    ) -> Artifact:
+        """
+        Build the artifact object of a listed artifact version. The sha256 is
+        only in the user metadata, it needs a HeadObject call.
+        """
+        if with_sha256:
+            s3path.head_object(bsm=bsm)
+            sha256 = s3path.metadata[METADATA_KEY_ARTIFACT_SHA256]
+        else:
+            sha256 = None
+        return Artifact(
+            name=name,
+            version=decode_filename(self._decode_basename(s3path.basename)),
+            update_at=s3path.last_modified_at.isoformat(),
+            s3uri=s3path.uri,
+            sha256=sha256,
+        )
+
     def list_artifact_versions(
         self,
         bsm: BotoSesManager,
         name: str,
+        with_sha256: bool = True,
     ) -> T.List[Artifact]:
         """
         Return a list of artifact versions. The latest version is always the first item.
@@ -506,22 +603,36 @@ class Repository:
 
         :param bsm: ``boto_session_manager.BotoSesManager`` object.
         :param name: artifact name.
-        """
-        artifact_list = list()
-        for s3path in self._list_artifact_versions_s3path(
-            bsm=bsm,
-            name=name,
-        ):
-            s3path.head_object(bsm=bsm)
-            artifact = Artifact(
-                name=name,
-                version=decode_filename(self._decode_basename(s3path.basename)),
-                update_at=s3path.last_modified_at.isoformat(),
-                s3uri=s3path.uri,
-                sha256=s3path.metadata[METADATA_KEY_ARTIFACT_SHA256],
+        :param with_sha256: the sha256 is only in the user metadata of the
+            S3 objects, it takes one HeadObject call per version, they are sent
+            concurrently. Set it to False if you don't need the sha256, the
+            versions are then built from the ListObjectsV2 response alone,
+            and their ``sha256`` is ``None``.
+        """
+        s3path_list = self._list_artifact_versions_s3path(bsm=bsm, name=name)
+        if with_sha256 is False or len(s3path_list) <= 1:
+            return [
+                self._get_artifact_object_from_s3path(
+                    bsm=bsm,
+                    name=name,
+                    s3path=s3path,
+                    with_sha256=with_sha256,
+                )
+                for s3path in s3path_list
+            ]
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_POOL_CONNECTIONS, len(s3path_list))
+        ) as executor:
+            return list(
+                executor.map(
+                    lambda s3path: self._get_artifact_object_from_s3path(
+                        bsm=bsm,
+                        name=name,
+                        s3path=s3path,
+                    ),
+                    s3path_list,
+                )
             )
-            artifact_list.append(artifact)
-        return artifact_list
 
     def publish_artifact_version(
         self,
@@ -549,7 +660,7 @@ class Repository:
         if n == 1:
             new_version = "1"
             s3path_new = self._get_artifact_s3path(name=name, version=new_version)
-            s3path_latest.copy_to(s3path_new, bsm=bsm)
+            copy_content(s3path_latest, s3path_new, bsm=bsm)
             s3path_new.head_object(bsm=bsm)
             return Artifact(
                 name=name,
@@ -576,7 +687,7 @@ class Repository:
                 )
             else:
                 s3path_new = self._get_artifact_s3path(name=name, version=new_version)
-                s3path_latest.copy_to(s3path_new, bsm=bsm)
+                copy_content(s3path_latest, s3path_new, bsm=bsm)
                 s3path_new.head_object(bsm=bsm)
                 return Artifact(
                     name=name,
@@ -619,11 +730,7 @@ class Repository:
 
         :return: list of artifact names.
         """
-        names = list()
-        for p in self.s3dir_artifact_store.iterdir(bsm=bsm):
-            if p.is_dir():
-                names.append(p.basename)
-        return names
+        return list_dir_names(self._s3dir_artifact_store, bsm=bsm)
 
     # ------------------------------------------------------------------------------
     # Alias
@@ -661,9 +768,10 @@ class Repository:
 
         if secondary_version is not None:
             secondary_version = encode_version(secondary_version)
-            if not isinstance(secondary_version_weight, int):
+            # exact type check, bool is a subclass of int
+            if type(secondary_version_weight) is not int:
                 raise TypeError("secondary_version_weight must be int")
-            if not (0 <= secondary_version_weight < 100):
+            if secondary_version_weight not in _WEIGHT_RANGE:
                 raise ValueError("secondary_version_weight must be 0 <= x < 100")
             if version == secondary_version:
                 raise ValueError(
@@ -674,23 +782,32 @@ class Repository:
         # ensure the artifact exists
         version_s3path = self._get_artifact_s3path(name=name, version=version)
         version_s3uri = version_s3path.uri
-        if version_s3path.exists(bsm=bsm) is False:
-            raise exc.ArtifactNotFoundError(
-                f"Cannot put alias to artifact name = {name!r}, version = {version}"
-            )
-
-        if secondary_version is not None:
+        if secondary_version is None:
+            secondary_version_s3uri = None
+            version_exists = version_s3path.exists(bsm=bsm)
+            secondary_version_exists = True
+        else:
             secondary_version_s3path = self._get_artifact_s3path(
                 name=name,
                 version=secondary_version,
             )
             secondary_version_s3uri = secondary_version_s3path.uri
-            if secondary_version_s3path.exists(bsm=bsm) is False:
-                raise exc.ArtifactNotFoundError(
-                    f"Cannot put alias to artifact name = {name!r}, version = {version}"
-                )
-        else:
-            secondary_version_s3uri = None
+            # check both versions concurrently
+            bsm.s3_client  # create the client once, before the threads share it
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                future = executor.submit(secondary_version_s3path.exists, bsm=bsm)
+                version_exists = version_s3path.exists(bsm=bsm)
+                secondary_version_exists = future.result()
+
+        if version_exists is False:
+            raise exc.ArtifactNotFoundError(
+                f"Cannot put alias to artifact name = {name!r}, version = {version}"
+            )
+        if secondary_version_exists is False:
+            raise exc.ArtifactNotFoundError(
+                f"Cannot put alias to artifact name = {name!r}, "
+                f"version = {secondary_version}"
+            )
 
         # create alias object
         alias_obj = Alias(
@@ -704,7 +821,7 @@ class Repository:
             secondary_version_s3uri=secondary_version_s3uri,
         )
         alias_s3path = self._get_alias_s3path(name=name, alias=alias)
-        alias_s3path.write_text(json.dumps(alias_obj.to_dict()), bsm=bsm)
+        alias_s3path.write_bytes(json_dumps_bytes(alias_obj.to_dict()), bsm=bsm)
         alias_s3path.head_object(bsm=bsm)
         alias_obj.update_at = alias_s3path.last_modified_at.isoformat()
         return alias_obj
@@ -736,12 +853,21 @@ class Repository:
         :param name: artifact name.
         """
         s3dir = self._get_artifact_s3dir(name=name).joinpath("aliases")
-        alias_list = list()
-        for s3path in s3dir.iter_objects(bsm=bsm):
-            alias = Alias.from_dict(json.loads(s3path.read_text(bsm=bsm)))
+        s3path_list = s3dir.iter_objects(bsm=bsm).all()
+
+        def read_alias(s3path: S3Path) -> Alias:
+            alias = Alias.from_dict(json_loads(s3path.read_bytes(bsm=bsm)))
+            # the listing already has the last modified time
             alias.update_at = s3path.last_modified_at.isoformat()
-            alias_list.append(alias)
-        return alias_list
+            return alias
+
+        if len(s3path_list) <= 1:
+            return [read_alias(s3path) for s3path in s3path_list]
+        # each alias is a separate GetObject, send them concurrently
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_POOL_CONNECTIONS, len(s3path_list))
+        ) as executor:
+            return list(executor.map(read_alias, s3path_list))
 
     def delete_alias(
         self,
@@ -776,12 +902,19 @@ class Repository:
         :param keep_last_n: number of versions to keep.
         :param purge_older_than_secs: seconds to keep.
         """
-        artifact_list = self.list_artifact_versions(bsm=bsm, name=name)
+        s3path_list = self._list_artifact_versions_s3path(bsm=bsm, name=name)
         purge_time = datetime.utcnow().replace(tzinfo=timezone.utc)
         expire = purge_time - timedelta(seconds=purge_older_than_secs)
         deleted_artifact_list = list()
-        for artifact in artifact_list[keep_last_n + 1 :]:
-            if artifact.update_datetime < expire:
+        # the listing already has the last modified time, only the versions
+        # to delete need the HeadObject call for the artifact object
+        for s3path in s3path_list[keep_last_n + 1 :]:
+            if s3path.last_modified_at < expire:
+                artifact = self._get_artifact_object_from_s3path(
+                    bsm=bsm,
+                    name=name,
+                    s3path=s3path,
+                )
                 self.delete_artifact_version(
                     bsm=bsm,
                     name=name,
@@ -812,4 +945,4 @@ class Repository:
 
         :param bsm: ``boto_session_manager.BotoSesManager`` object.
         """
-        self.s3dir_artifact_store.delete(bsm=bsm)
+        self._s3dir_artifact_store.delete(bsm=bsm)
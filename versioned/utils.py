@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""
+Utility functions shared by the backends.
+"""
+
+import typing as T
+from datetime import datetime
+from hashlib import sha256 as _sha256
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from func_args import NOTHING, resolve_kwargs
+from s3pathlib import S3Path, context
+from s3pathlib.tag import encode_url_query
+
+from .constants import MAX_POOL_CONNECTIONS
+
+if T.TYPE_CHECKING:  # pragma: no cover
+    from boto_session_manager import BotoSesManager
+
+# read the file object 1 MB at a time when hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+# download large content with concurrent ranged GETs of this size
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# read_content() starts over when the object changes, up to this many times
+READ_CONTENT_ATTEMPTS = 3
+# the biggest source a single CopyObject accepts
+COPY_OBJECT_MAX_SIZE = 5 * 1024 ** 3
+
+BOTO_CLIENT_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 10},
+)
+
+# multipart transfer of large content, one part per pooled connection at most
+TRANSFER_CONFIG = TransferConfig(
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=MAX_POOL_CONNECTIONS,
+)
+
+
+def get_content_sha256(content: T.Union[bytes, T.BinaryIO]) -> str:
+    """
+    Get the sha256 of an artifact content.
+
+    :param content: binary content, or a seekable binary file object. The file
+        object is hashed chunk by chunk and rewound back to where it was, so
+        it can be uploaded right after.
+    """
+    if isinstance(content, bytes):
+        return _sha256(content).hexdigest()
+    start = content.tell()
+    m = _sha256()
+    while True:
+        chunk = content.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        m.update(chunk)
+    content.seek(start)
+    return m.hexdigest()
+
+
+def write_content(
+    s3path: S3Path,
+    content: T.Union[bytes, T.BinaryIO],
+    metadata: T.Dict[str, str] = NOTHING,
+    content_type: str = NOTHING,
+    tags: T.Dict[str, str] = NOTHING,
+    bsm: T.Optional["BotoSesManager"] = None,
+):
+    """
+    Write an artifact content to S3. A file object is streamed with
+    ``upload_fileobj``, which switches to a concurrent multipart upload for
+    large content, see :data:`TRANSFER_CONFIG`.
+
+    :param bsm: use the ``s3pathlib`` global context when not given.
+    """
+    if isinstance(content, bytes):
+        s3path.write_bytes(
+            content,
+            metadata=metadata,
+            content_type=content_type,
+            tags=tags,
+            bsm=bsm,
+        )
+        return
+    s3_client = context.s3_client if bsm is None else bsm.s3_client
+    s3_client.upload_fileobj(
+        content,
+        Bucket=s3path.bucket,
+        Key=s3path.key,
+        ExtraArgs=resolve_kwargs(
+            Metadata=metadata,
+            ContentType=content_type,
+            Tagging=tags if tags is NOTHING else encode_url_query(tags),
+        ),
+        Config=TRANSFER_CONFIG,
+    )
+
+
+def read_content(
+    s3path: S3Path,
+    bsm: T.Optional["BotoSesManager"] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+) -> bytes:
+    """
+    Read an artifact content from S3. The first ``chunk_size`` bytes are read
+    with a ranged ``GetObject``, it is the only request for small and empty
+    content. The rest of a large content is read with concurrent ranged
+    ``GetObject``, all pinned to the ETag of the first response, so the parts
+    always come from the same object. If the object is overwritten in the
+    meantime, the read starts over, at most :data:`READ_CONTENT_ATTEMPTS`
+    times in total before the ``PreconditionFailed`` error is raised.
+
+    :param bsm: use the ``s3pathlib`` global context when not given.
+    """
+    s3_client = context.s3_client if bsm is None else bsm.s3_client
+    for attempt in range(1, READ_CONTENT_ATTEMPTS + 1):
+        try:
+            return _read_content(s3_client, s3path, chunk_size)
+        except ClientError as e:
+            if (
+                e.response["Error"]["Code"] != "PreconditionFailed"
+                or attempt == READ_CONTENT_ATTEMPTS
+            ):
+                raise
+
+
+def _read_content(s3_client, s3path: S3Path, chunk_size: int) -> bytes:
+    """
+    A single attempt of :func:`read_content`.
+    """
+    kwargs = dict(Bucket=s3path.bucket, Key=s3path.key)
+    try:
+        res = s3_client.get_object(Range=f"bytes=0-{chunk_size - 1}", **kwargs)
+    except ClientError as e:
+        # S3 rejects any range of an empty object
+        error = e.response["Error"]
+        if error["Code"] == "InvalidRange" and error.get("ActualObjectSize") == "0":
+            return b""
+        raise
+    first = res["Body"].read()
+    total = int(res["ContentRange"].rsplit("/", 1)[1])
+    if total <= chunk_size:
+        return first
+
+    etag = res["ETag"]
+
+    def read_range(start: int) -> bytes:
+        end = min(start + chunk_size, total) - 1
+        return s3_client.get_object(
+            Range=f"bytes={start}-{end}",
+            IfMatch=etag,
+            **kwargs,
+        )["Body"].read()
+
+    starts = range(chunk_size, total, chunk_size)
+    with ThreadPoolExecutor(
+        max_workers=min(len(starts), MAX_POOL_CONNECTIONS)
+    ) as executor:
+        parts = list(executor.map(read_range, starts))
+    parts.insert(0, first)
+    return b"".join(parts)
+
+
+def list_dir_names(
+    s3dir: S3Path,
+    bsm: T.Optional["BotoSesManager"] = None,
+) -> T.List[str]:
+    """
+    Return the names of the sub folders of an S3 folder. It reads the
+    ``CommonPrefixes`` of a delimited ``ListObjectsV2`` directly, without
+    building an ``S3Path`` for every entry like ``S3Path.iterdir`` does.
+
+    :param bsm: use the ``s3pathlib`` global context when not given.
+    """
+    s3_client = context.s3_client if bsm is None else bsm.s3_client
+    prefix = s3dir.key
+    n = len(prefix)
+    names = list()
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for res in paginator.paginate(
+        Bucket=s3dir.bucket,
+        Prefix=prefix,
+        Delimiter="/",
+    ):
+        for dct in res.get("CommonPrefixes", []):
+            names.append(dct["Prefix"][n:-1])
+    return names
+
+
+def copy_content(
+    s3path_src: S3Path,
+    s3path_dst: S3Path,
+    bsm: T.Optional["BotoSesManager"] = None,
+) -> datetime:
+    """
+    Server side copy an artifact content, with its metadata and tags.
+    ``CopyObject`` is limited to 5 GB, a source bigger than
+    :data:`COPY_OBJECT_MAX_SIZE` goes through the boto3 managed copy, which
+    uses multipart ``UploadPartCopy``, the bytes never leave S3 either way.
+
+    :param bsm: use the ``s3pathlib`` global context when not given.
+
+    :return: the last modified time of the copy, truncated to seconds like
+        the one ``HeadObject`` returns.
+    """
+    s3_client = context.s3_client if bsm is None else bsm.s3_client
+    copy_source = {"Bucket": s3path_src.bucket, "Key": s3path_src.key}
+    try:
+        res = s3_client.copy_object(
+            Bucket=s3path_dst.bucket,
+            Key=s3path_dst.key,
+            CopySource=copy_source,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "InvalidRequest":
+            raise
+        # InvalidRequest has many other causes, only the size is handled here
+        res = s3_client.head_object(**copy_source)
+        if res["ContentLength"] <= COPY_OBJECT_MAX_SIZE:
+            raise
+        s3_client.copy(
+            CopySource=copy_source,
+            Bucket=s3path_dst.bucket,
+            Key=s3path_dst.key,
+            ExtraArgs=resolve_kwargs(
+                Metadata=res.get("Metadata", NOTHING),
+                ContentType=res.get("ContentType", NOTHING),
+            ),
+            Config=TRANSFER_CONFIG,
+        )
+        # a multipart upload doesn't carry the tags over
+        tag_set = s3_client.get_object_tagging(**copy_source)["TagSet"]
+        if tag_set:
+            s3_client.put_object_tagging(
+                Bucket=s3path_dst.bucket,
+                Key=s3path_dst.key,
+                Tagging={"TagSet": tag_set},
+            )
+        # the managed copy doesn't return the result
+        res = s3_client.head_object(Bucket=s3path_dst.bucket, Key=s3path_dst.key)
+        return res["LastModified"]
+    return res["CopyObjectResult"]["LastModified"].replace(microsecond=0)